@@ -0,0 +1,229 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Simulated SNMP agents for benchmarking and testing without hardware"""
+
+import asyncio
+from bisect import bisect_right
+import random
+import threading
+from rockit.power.apc_device import (
+    APCATSInputSourceParameter,
+    APCPDUSocketParameter,
+    APCUPSBatteryHealthyParameter,
+    APCUPSBatteryRemainingParameter,
+    APCUPSOutputLoadParameter,
+    APCUPSSocketGroupParameter,
+    APCUPSStatusParameter)
+from rockit.power.netgear_device import NetgearPoESocketParameter
+from rockit.power.snmp import (
+    decode_message, encode_message, Gauge32, Integer, END_OF_MIB_VIEW, NO_SUCH_OBJECT,
+    PDU_GET, PDU_GET_BULK, PDU_GET_NEXT, PDU_RESPONSE, PDU_SET, SNMPError, VERSION_1)
+
+# SNMP error status codes
+NO_ERROR = 0
+NO_SUCH_NAME = 2
+READ_ONLY = 4
+
+
+def _oid_key(oid):
+    return tuple(int(x) for x in oid.strip('.').split('.'))
+
+
+def build_mib(device_type, rows=8):
+    """Returns a dictionary of initial values keyed by OID for a simulated device, and a
+       dictionary mapping writable OIDs to functions that apply a set and return the echoed value.
+       rows is the number of outlets (APCPDU), ports (NetgearPOE), or outlet groups (APCUPS)
+       OIDs are taken from the parameter classes so they always match the real devices
+    """
+    mib = {}
+    writable = {}
+
+    def add_switch(parameter, on_value, status_on=None, status_off=None):
+        """Adds a switch that is initially on. Devices that report state through a different value
+           to the one that is set (Netgear PoE) also define status_on and status_off
+        """
+        mib[parameter.get_oid] = Integer(on_value if status_on is None else status_on)
+
+        def apply(value):
+            if status_on is None:
+                mib[parameter.get_oid] = Integer(value)
+            else:
+                mib[parameter.get_oid] = Integer(status_on if value == on_value else status_off)
+            return Integer(value)
+        writable[parameter.set_oid] = apply
+
+    if device_type == 'APCPDU':
+        for i in range(1, rows + 1):
+            add_switch(APCPDUSocketParameter('', i), 1)
+
+    elif device_type == 'APCUPS':
+        mib[APCUPSStatusParameter('').get_oid] = Integer(2)
+        mib[APCUPSBatteryRemainingParameter('').get_oid] = Gauge32(100)
+        mib[APCUPSBatteryHealthyParameter('').get_oid] = Integer(1)
+        mib[APCUPSOutputLoadParameter('').get_oid] = Gauge32(15)
+        for i in range(1, min(rows, 4) + 1):
+            add_switch(APCUPSSocketGroupParameter('', i), 1)
+
+    elif device_type == 'APCATS':
+        mib[APCATSInputSourceParameter('').get_oid] = Integer(1)
+
+    elif device_type == 'NetgearPOE':
+        # Enabling a port sets the admin state, and the detection status reports power delivery (3) or searching (2)
+        for i in range(1, rows + 1):
+            add_switch(NetgearPoESocketParameter('', i), 1, 3, 2)
+
+    else:
+        raise ValueError(f'Unable to simulate device type {device_type}')
+
+    return mib, writable
+
+
+class _AgentProtocol(asyncio.DatagramProtocol):
+    """Answers SNMP requests for a single simulated agent"""
+    def __init__(self, agent):
+        self._agent = agent
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        agent = self._agent
+        agent.requests += 1
+        if agent.dead or (agent.loss and agent.random.random() < agent.loss):
+            agent.dropped += 1
+            return
+
+        try:
+            response = agent.respond(decode_message(data))
+        except SNMPError:
+            return
+
+        if agent.latency:
+            delay = agent.latency * agent.random.uniform(1 - agent.jitter, 1 + agent.jitter)
+            asyncio.get_running_loop().call_later(delay, self._transport.sendto, response, addr)
+        else:
+            self._transport.sendto(response, addr)
+
+
+class SimulatedAgent:
+    """A simulated SNMP agent for an APCPDU, APCUPS, APCATS, or NetgearPOE device
+       latency is the mean response delay in seconds (varied by +/- jitter as a fraction),
+       loss is the fraction of requests to silently drop, and dead agents never respond.
+       These may be changed while the agent is running.
+       Each agent draws its losses and delays from its own random generator, so runs are repeatable for a given seed
+    """
+    def __init__(self, device_type, rows=8, latency=0, jitter=0.1, loss=0, dead=False, seed=None):
+        self.device_type = device_type
+        self.rows = rows
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.dead = dead
+        self.port = None
+        self.random = random.Random(seed)
+
+        self.requests = 0
+        self.dropped = 0
+
+        self._mib, self._writable = build_mib(device_type, rows)
+        self._order = sorted(self._mib, key=_oid_key)
+        self._keys = [_oid_key(oid) for oid in self._order]
+
+    def __next_oid(self, oid):
+        """Returns the first OID in the MIB that sorts after oid, or None at the end of the MIB"""
+        i = bisect_right(self._keys, _oid_key(oid))
+        return self._order[i] if i < len(self._order) else None
+
+    def respond(self, request):
+        """Returns the encoded response to a decoded request"""
+        pdu_type = request['pdu_type']
+        varbinds = []
+        error_status = NO_ERROR
+        error_index = 0
+
+        if pdu_type == PDU_GET:
+            for i, (oid, _) in enumerate(request['varbinds']):
+                if oid not in self._mib and request['version'] == VERSION_1:
+                    error_status, error_index = NO_SUCH_NAME, i + 1
+                varbinds.append((oid, self._mib.get(oid, NO_SUCH_OBJECT)))
+
+        elif pdu_type == PDU_GET_NEXT:
+            for i, (oid, _) in enumerate(request['varbinds']):
+                next_oid = self.__next_oid(oid)
+                if next_oid is None:
+                    if request['version'] == VERSION_1:
+                        error_status, error_index = NO_SUCH_NAME, i + 1
+                    varbinds.append((oid, END_OF_MIB_VIEW))
+                else:
+                    varbinds.append((next_oid, self._mib[next_oid]))
+
+        elif pdu_type == PDU_GET_BULK:
+            # Every varbind is treated as a repeater (non-repeaters is not used by SNMPClient)
+            for oid, _ in request['varbinds']:
+                for _ in range(max(request['error_index'], 1)):
+                    next_oid = self.__next_oid(oid)
+                    if next_oid is None:
+                        varbinds.append((oid, END_OF_MIB_VIEW))
+                        break
+                    varbinds.append((next_oid, self._mib[next_oid]))
+                    oid = next_oid
+
+        elif pdu_type == PDU_SET:
+            # Sets are atomic: nothing is changed if any varbind is invalid
+            for i, (oid, _) in enumerate(request['varbinds']):
+                if oid not in self._writable:
+                    error_status, error_index = READ_ONLY if oid in self._mib else NO_SUCH_NAME, i + 1
+                    varbinds = request['varbinds']
+                    break
+            else:
+                varbinds = [(oid, self._writable[oid](int(value))) for oid, value in request['varbinds']]
+
+        else:
+            raise SNMPError(f'Unsupported PDU type 0x{pdu_type:02x}')
+
+        return encode_message(request['version'], request['community'], PDU_RESPONSE, request['request_id'],
+                              varbinds, error_status, error_index)
+
+
+class AgentFleet:
+    """Runs any number of SimulatedAgents on loopback UDP ports from a single background event loop"""
+    def __init__(self, host='127.0.0.1'):
+        self.host = host
+        self.agents = []
+        self._loop = asyncio.new_event_loop()
+        self._transports = []
+        thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        thread.start()
+
+    def add(self, agent, port=0):
+        """Starts serving an agent on the given port (default any free port), which is stored in agent.port"""
+        async def open_endpoint():
+            return await self._loop.create_datagram_endpoint(
+                lambda: _AgentProtocol(agent), local_addr=(self.host, port))
+
+        transport, _ = asyncio.run_coroutine_threadsafe(open_endpoint(), self._loop).result()
+        agent.port = transport.get_extra_info('sockname')[1]
+        self._transports.append(transport)
+        self.agents.append(agent)
+        return agent
+
+    def close(self):
+        """Stops all agents"""
+        for transport in self._transports:
+            self._loop.call_soon_threadsafe(transport.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -19,6 +19,8 @@ mkdir -p %{buildroot}%{_sysconfdir}/powerd/
 %{__install} %{_sourcedir}/light %{buildroot}%{_bindir}
 %{__install} %{_sourcedir}/powerd %{buildroot}%{_bindir}
 %{__install} %{_sourcedir}/powerd@.service %{buildroot}%{_unitdir}
+%{__install} %{_sourcedir}/poweraggd %{buildroot}%{_bindir}
+%{__install} %{_sourcedir}/poweraggd@.service %{buildroot}%{_unitdir}
 %{__install} %{_sourcedir}/completion/power %{buildroot}/etc/bash_completion.d
 %{__install} %{_sourcedir}/completion/light %{buildroot}/etc/bash_completion.d
 
@@ -33,14 +35,16 @@ mkdir -p %{buildroot}%{_sysconfdir}/powerd/
 %package server
 Summary:  Power control server
 Group:    Unspecified
-Requires: python3-rockit-power net-snmp-utils
+Requires: python3-rockit-power
 %description server
 
 %files server
 %defattr(0755,root,root,-)
 %{_bindir}/powerd
+%{_bindir}/poweraggd
 %defattr(0644,root,root,-)
 %{_unitdir}/powerd@.service
+%{_unitdir}/poweraggd@.service
 
 %package client
 Summary:  Power control client
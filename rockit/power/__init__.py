@@ -16,5 +16,31 @@
 
 """powerd common code"""
 
+import importlib
+from .cache import read_daemon_cache, write_daemon_cache
+from .circuit_breaker import CircuitBreakerState
 from .config import Config
 from .constants import Parameter, SwitchableParameter, SwitchStatus, APCUPSStatus
+
+# Daemon-only classes are imported on first use so that the commandline tools
+# don't pay for loading numpy, Pyro callbacks, the http server, etc
+_LAZY_IMPORTS = {
+    'ChangeFeed': '.change_feed',
+    'MeasurementHistory': '.history',
+    'history_capacity': '.history',
+    'HistoryStore': '.history_store',
+    'MetricsServer': '.metrics',
+    'render_metrics': '.metrics',
+    'DevicePoller': '.poller',
+    'PollScheduler': '.poller',
+    'Outcome': '.stats',
+    'PerformanceStats': '.stats',
+    'SubscriptionManager': '.subscriptions',
+    'SNMPTransport': '.snmp_transport',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        return getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+    raise AttributeError(f'module {__name__} has no attribute {name}')
@@ -0,0 +1,326 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Merges several power daemons into a single namespaced interface"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import datetime
+import json
+import threading
+import time
+from rockit.common import daemons, IP, validation
+from .pyro_proxy import PyroProxy
+
+# Separates the member name from the parameter name in the merged interface, e.g. onemetre.light
+NAMESPACE_SEPARATOR = '.'
+
+AGGREGATOR_CONFIG_SCHEMA = {
+    'type': 'object',
+    'additionalProperties': False,
+    'required': ['daemon', 'log_name', 'control_machines', 'members'],
+    'properties': {
+        'daemon': {
+            'type': 'string',
+            'daemon_name': True
+        },
+        'log_name': {
+            'type': 'string',
+        },
+        'control_machines': {
+            'type': 'array',
+            'items': {
+                'type': 'string',
+                'machine_name': True
+            }
+        },
+        'members': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'additionalProperties': False,
+                'required': ['name', 'daemon'],
+                'properties': {
+                    # Prefix for the member's parameter names
+                    'name': {
+                        'type': 'string'
+                    },
+                    'label': {
+                        'type': 'string'
+                    },
+                    'daemon': {
+                        'type': 'string',
+                        'daemon_name': True
+                    },
+                    # Deadline in seconds for each query to this member
+                    'query_timeout': {
+                        'type': 'number',
+                        'min': 0,
+                        'max': 60
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+class AggregatorConfig:
+    """Aggregator configuration parsed from a json file"""
+    def __init__(self, config_filename):
+        # Will throw on file not found or invalid json
+        with open(config_filename, 'r', encoding='utf-8') as config_file:
+            config_json = json.load(config_file)
+
+        # Will throw on schema violations
+        validation.validate_config(config_json, AGGREGATOR_CONFIG_SCHEMA, {
+            'daemon_name': validation.daemon_name_validator,
+            'machine_name': validation.machine_name_validator
+        })
+
+        self.daemon_name = config_json['daemon']
+        self.daemon = getattr(daemons, config_json['daemon'])
+        self.log_name = config_json['log_name']
+        self.control_ips = [getattr(IP, machine) for machine in config_json['control_machines']]
+        self.members = config_json['members']
+
+        names = [m['name'] for m in self.members]
+        if len(set(names)) != len(names):
+            raise ValueError('member names must be unique')
+
+        for name in names:
+            if NAMESPACE_SEPARATOR in name:
+                raise ValueError(f'member name {name} must not contain "{NAMESPACE_SEPARATOR}"')
+
+
+class PowerMember:
+    """A power daemon that is queried by the aggregator
+       Keeps its labels and the most recent successful measurement for serving partial results.
+       The labels are queried again after a reconnect or when the measured parameters change
+       (e.g. the member has reloaded its config)
+    """
+    def __init__(self, config):
+        self.name = config['name']
+        self.label = config.get('label', config['name'])
+        self.query_timeout = config.get('query_timeout', 5)
+        self._proxy = PyroProxy(getattr(daemons, config['daemon']))
+        self.stats = self._proxy.stats
+
+        self._lock = threading.Lock()
+        self._labels = None
+
+        # Parameter names and proxy connection count when the labels were last received
+        self._label_parameters = None
+        self._label_connection = None
+
+        self._measurement = None
+        self._measurement_time = None
+        self._error = None
+
+    def labels(self, parameters=None):
+        """Returns the member's measurement labels, querying the daemon only until they are first received
+           parameters is the set of parameter names in the measurement that the labels must describe
+        """
+        with self._lock:
+            if self._labels is not None and parameters == self._label_parameters and \
+                    self._proxy.connections == self._label_connection:
+                return self._labels
+
+        labels = self._proxy.call('measurement_labels', timeout=self.query_timeout)
+        connection = self._proxy.connections
+        with self._lock:
+            self._labels = labels
+            self._label_parameters = parameters
+            self._label_connection = connection
+        return labels
+
+    def refresh(self):
+        """Queries the latest measurement, and the labels if they haven't been received yet or no longer match the
+           measured parameters. Returns True on success
+        """
+        try:
+            measurement = self._proxy.call('last_measurement', timeout=self.query_timeout)
+            self.labels({k for k in measurement if k not in ['date', 'timed_out']})
+        except Exception as exception:
+            with self._lock:
+                self._error = str(exception)
+            raise
+
+        with self._lock:
+            self._measurement = measurement
+            self._measurement_time = time.time()
+            self._error = None
+        return True
+
+    def cached(self):
+        """Returns (labels, last measurement, time of last measurement, last error) without querying the daemon"""
+        with self._lock:
+            return self._labels, self._measurement, self._measurement_time, self._error
+
+    def call(self, method, *args, write=False):
+        """Calls a method on the member daemon"""
+        return self._proxy.call(method, *args, timeout=self.query_timeout, write=write)
+
+
+class PowerAggregator:
+    """Queries every member in parallel and merges their results
+       Parameter names are prefixed by the member name, e.g. onemetre.light
+    """
+    def __init__(self, members):
+        self._members = {m.name: m for m in members}
+
+        # Each member has at most one measurement query in progress, leaving the remaining
+        # workers free for switching and label queries when a member stops responding
+        self._executor = ThreadPoolExecutor(max_workers=max(2 * len(members), 1))
+        self._lock = threading.Lock()
+        self._pending_refresh = {}
+
+    def __split(self, name):
+        """Returns the member and unprefixed parameter name for a namespaced parameter, or (None, None)"""
+        member_name, _, parameter = name.partition(NAMESPACE_SEPARATOR)
+        member = self._members.get(member_name)
+        if member is None or not parameter:
+            return None, None
+        return member, parameter
+
+    def __fan_out(self, function, members):
+        """Calls function(member) for each member in parallel, waiting up to each member's query_timeout
+           Returns a dictionary of results keyed by member name, with None for members that failed
+        """
+        return self.__wait({m.name: self._executor.submit(function, m) for m in members}, members)
+
+    def __wait(self, futures, members):
+        """Waits for a future keyed by name for each member, giving up after the member's query_timeout"""
+        start = time.monotonic()
+        results = {}
+        for member in members:
+            future = futures[member.name]
+            remaining = member.query_timeout - (time.monotonic() - start)
+            wait([future], timeout=max(remaining, 0))
+            if future.done() and future.exception() is None:
+                results[member.name] = future.result()
+            else:
+                results[member.name] = None
+        return results
+
+    def measurement(self):
+        """Returns the merged measurement from every member that has responded at least once
+           The 'members' entry reports the date and age of each member's data, whether the latest
+           query succeeded, and the error message if it did not
+        """
+        # Callers share a query that is already in progress (e.g. to a member that isn't responding)
+        with self._lock:
+            for member in self._members.values():
+                pending = self._pending_refresh.get(member.name)
+                if pending is None or pending.done():
+                    self._pending_refresh[member.name] = self._executor.submit(member.refresh)
+            futures = dict(self._pending_refresh)
+
+        responded = self.__wait(futures, list(self._members.values()))
+        now = time.time()
+        data = {
+            'date': datetime.datetime.utcfromtimestamp(now).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'members': {}
+        }
+
+        for member in self._members.values():
+            _, measurement, measurement_time, error = member.cached()
+            online = responded[member.name] is not None
+            if not online and error is None:
+                error = f'no response within {member.query_timeout} seconds'
+
+            data['members'][member.name] = {
+                'date': measurement['date'] if measurement else None,
+                'age': now - measurement_time if measurement_time else None,
+                'online': online,
+                'error': None if online else error
+            }
+
+            for key, value in (measurement or {}).items():
+                if key == 'date':
+                    continue
+                if key == 'timed_out':
+                    value = [member.name + NAMESPACE_SEPARATOR + n for n in value]
+                    data.setdefault('timed_out', []).extend(value)
+                    continue
+                data[member.name + NAMESPACE_SEPARATOR + key] = value
+
+        data.setdefault('timed_out', [])
+        return data
+
+    def labels(self):
+        """Returns the merged measurement labels, querying any members whose labels haven't been received yet"""
+        missing = [m for m in self._members.values() if m.cached()[0] is None]
+        if missing:
+            self.__fan_out(lambda m: m.labels(), missing)
+
+        labels = []
+        for member in self._members.values():
+            for label in member.cached()[0] or []:
+                labels.append({
+                    'name': member.name + NAMESPACE_SEPARATOR + label['name'],
+                    'label': label['label'],
+                    'type': label['type'],
+                    'member': member.name,
+                    'member_label': member.label
+                })
+        return labels
+
+    def switch(self, name, enable):
+        """Switch a namespaced switch parameter on or off"""
+        member, parameter = self.__split(name)
+        if member is None:
+            return False
+
+        try:
+            return member.call('switch', parameter, enable, write=True)
+        except Exception as exception:
+            print(f'{datetime.datetime.utcnow()} ERROR: failed to switch {name}: {exception}')
+            return False
+
+    def switch_many(self, states):
+        """Switch several namespaced switch parameters on or off, sending each member's changes together
+           Returns a dictionary of success flags keyed by switch name
+        """
+        results = {name: False for name in states}
+        by_member = {}
+        for name, enable in states.items():
+            member, parameter = self.__split(name)
+            if member is not None:
+                by_member.setdefault(member, {})[parameter] = enable
+
+        def switch_member(member):
+            return member.call('switch_many', by_member[member], write=True)
+
+        for member_name, member_results in self.__fan_out(switch_member, list(by_member)).items():
+            if member_results is None:
+                print(f'{datetime.datetime.utcnow()} ERROR: failed to switch {member_name} parameters')
+                continue
+
+            for parameter, success in member_results.items():
+                results[member_name + NAMESPACE_SEPARATOR + parameter] = success
+        return results
+
+    def value(self, name, max_age=None):
+        """Query the value of a namespaced parameter from its member. Returns None if the member fails"""
+        member, parameter = self.__split(name)
+        if member is None:
+            return False
+
+        try:
+            return member.call('value', parameter, max_age)
+        except Exception as exception:
+            print(f'{datetime.datetime.utcnow()} ERROR: failed to query {name}: {exception}')
+            return None
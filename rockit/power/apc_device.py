@@ -17,78 +17,105 @@
 """APC-specific parameters for SNMPDevice"""
 
 from .constants import SwitchStatus, APCUPSStatus, SwitchableParameter
+from .snmp import Gauge32, Integer
 from .snmp_device import SNMPParameter, IntegerSNMPParameter
 
+PDU_OUTLET_STATE_COLUMN = '.1.3.6.1.4.1.318.1.1.12.3.3.1.1.4'
+
 
 class APCPDUSocketParameter(IntegerSNMPParameter, SwitchableParameter):
     """Parameter representing a specific PDU socket"""
+    history_dtype = 'u1'
+
     def __init__(self, name, socket):
-        oid = '.1.3.6.1.4.1.318.1.1.12.3.3.1.1.4.' + str(socket)
-        IntegerSNMPParameter.__init__(self, name, oid, oid, SwitchStatus.Unknown)
+        oid = PDU_OUTLET_STATE_COLUMN + '.' + str(socket)
+        IntegerSNMPParameter.__init__(self, name, oid, oid, SwitchStatus.Unknown,
+                                      column_oid=PDU_OUTLET_STATE_COLUMN, row_index=str(socket))
 
     def format_set_value(self, value):
-        """Format a python value to a string to send via SNMP"""
-        return '1' if value == SwitchStatus.On else '2'
+        """Format a python value to send via SNMP"""
+        return Integer(1 if value == SwitchStatus.On else 2)
 
-    def parse_snmpget_output(self, output):
-        """Convert a snmpget output string for this parameter into a python value"""
-        return SwitchStatus.On if IntegerSNMPParameter.parse_snmpget_output(self, output) == 1 else SwitchStatus.Off
+    def parse_get_value(self, value):
+        """Convert a value returned by a SNMP get for this parameter into a python value"""
+        return SwitchStatus.On if IntegerSNMPParameter.parse_get_value(self, value) == 1 else SwitchStatus.Off
 
 
 class APCUPSSocketGroupParameter(IntegerSNMPParameter, SwitchableParameter):
     """Parameter representing a specific UPS socket group"""
+    history_dtype = 'u1'
+
     def __init__(self, name, socket):
         oid = '.1.3.6.1.4.1.318.1.1.1.12.3.2.1.3.' + str(socket)
         IntegerSNMPParameter.__init__(self, name, oid, oid, SwitchStatus.Unknown)
 
     def format_set_value(self, value):
-        """Format a python value to a string to send via SNMP"""
-        return '1' if value == SwitchStatus.On else '2'
+        """Format a python value to send via SNMP"""
+        return Integer(1 if value == SwitchStatus.On else 2)
 
-    def parse_snmpget_output(self, output):
-        """Convert a snmpget output string for this parameter into a python value"""
-        return SwitchStatus.On if IntegerSNMPParameter.parse_snmpget_output(self, output) == 1 else SwitchStatus.Off
+    def parse_get_value(self, value):
+        """Convert a value returned by a SNMP get for this parameter into a python value"""
+        return SwitchStatus.On if IntegerSNMPParameter.parse_get_value(self, value) == 1 else SwitchStatus.Off
 
 
 class APCUPSStatusParameter(IntegerSNMPParameter):
     """Parameter representing the read-only UPS status enum"""
+    history_dtype = 'u1'
+
     def __init__(self, name):
         oid = '.1.3.6.1.4.1.318.1.1.1.4.1.1.0'
         IntegerSNMPParameter.__init__(self, name, oid, None, APCUPSStatus.Unknown)
 
+    def fast_poll_reason(self, value, previous):
+        """Track the battery closely while the UPS is supplying the load"""
+        return 'on battery' if value == APCUPSStatus.OnBattery else None
+
 
 class APCUPSBatteryHealthyParameter(IntegerSNMPParameter):
     """Parameter representing the read-only UPS battery health flag"""
+    history_dtype = '?'
+
     def __init__(self, name):
         IntegerSNMPParameter.__init__(self, name, '.1.3.6.1.4.1.318.1.1.1.2.2.4.0', None, False)
 
-    def parse_snmpget_output(self, output):
-        """Convert a snmpget output string for this parameter into a python value"""
-        return IntegerSNMPParameter.parse_snmpget_output(self, output) == 1
+    def parse_get_value(self, value):
+        """Convert a value returned by a SNMP get for this parameter into a python value"""
+        return IntegerSNMPParameter.parse_get_value(self, value) == 1
+
+    def fast_poll_reason(self, value, previous):
+        """Track the UPS closely while the battery needs replacing"""
+        return 'battery unhealthy' if not value else None
 
 
 class APCATSInputSourceParameter(IntegerSNMPParameter):
     """Parameter representing the read-only ATS source scalar"""
+    history_dtype = 'u1'
+
     def __init__(self, name):
         IntegerSNMPParameter.__init__(self, name, '.1.3.6.1.4.1.318.1.1.8.5.1.2.0', None, 0)
 
+    def fast_poll_reason(self, value, previous):
+        """Track the ATS closely after it has switched input"""
+        return 'source changed' if previous is not None and value != previous else None
+
 
 class APCGaugeParameter(SNMPParameter):
     """Data structure encapsulating a readonly UPS Gauge parameter"""
+    history_dtype = 'u2'
+
     def __init__(self, name, oid):
         SNMPParameter.__init__(self, name, oid, None, 0)
 
-    def parse_snmpget_output(self, output):
-        """Convert a snmpget output string for this parameter into a python value"""
-        parts = output.split(' ')
-        if parts[-2] != 'Gauge32:':
-            raise Exception('Unabled to parse Gauge32 from SNMP output: ' + output)
+    def parse_get_value(self, value):
+        """Convert a value returned by a SNMP get for this parameter into a python value"""
+        if not isinstance(value, Gauge32):
+            raise Exception(f'Unable to parse Gauge32 from SNMP value: {value!r}')
 
-        return int(parts[-1])
+        return int(value)
 
-    def parse_snmpset_output(self, output):
-        """Convert a snmpset output string for this parameter into a python value"""
-        return self.parse_snmpget_output(output)
+    def parse_set_value(self, value):
+        """Convert a value returned by a SNMP set for this parameter into a python value"""
+        return self.parse_get_value(value)
 
 
 class APCUPSBatteryRemainingParameter(APCGaugeParameter):
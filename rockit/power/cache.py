@@ -0,0 +1,89 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local caches that let the commandline tools start without validating the config or contacting the daemon"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+# Validated config files are cached per-user, keyed by the config path, modification time, and size
+CONFIG_CACHE_DIRECTORY = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                                      'rockit-power')
+
+# Written by the daemon (see RuntimeDirectory in powerd@.service) and read by the clients
+DAEMON_CACHE_DIRECTORY = '/run/powerd'
+
+
+def _write_atomic(path, data):
+    """Writes a json file so that readers never see a partially written file"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, encoding='utf-8') as f:
+        json.dump(data, f)
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+
+def _config_cache_path(config_path):
+    key = hashlib.sha1(os.path.abspath(config_path).encode('utf-8')).hexdigest()
+    return os.path.join(CONFIG_CACHE_DIRECTORY, key + '.json')
+
+
+def config_stat(config_path):
+    """Returns the (modification time, size) used to detect changes to a config file"""
+    stat = os.stat(config_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_cached_config(config_path, stat):
+    """Returns the cached json for a previously validated config file, or None if it is missing or out of date"""
+    try:
+        with open(_config_cache_path(config_path), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if cached.get('path') != os.path.abspath(config_path) or cached.get('stat') != list(stat):
+        return None
+    return cached.get('config')
+
+
+def store_cached_config(config_path, stat, config_json):
+    """Caches a validated config file. Failures (e.g. a read-only home directory) are ignored"""
+    try:
+        _write_atomic(_config_cache_path(config_path), {
+            'path': os.path.abspath(config_path),
+            'stat': list(stat),
+            'config': config_json
+        })
+    except OSError:
+        pass
+
+
+def write_daemon_cache(daemon_name, data):
+    """Publishes daemon metadata (e.g. switch names) for the clients to read without a Pyro query"""
+    _write_atomic(os.path.join(DAEMON_CACHE_DIRECTORY, daemon_name + '.json'), data)
+
+
+def read_daemon_cache(daemon_name):
+    """Returns the metadata published by the daemon, or None if it is not available"""
+    try:
+        with open(os.path.join(DAEMON_CACHE_DIRECTORY, daemon_name + '.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,92 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tracks which parameters changed in each poll so clients can fetch only the differences"""
+
+import threading
+import time
+
+# Upper limit on how long a client can block waiting for changes
+MAX_WAIT_TIMEOUT = 30
+
+# Upper limit on the number of clients blocked waiting for changes at once. Each holds a
+# Pyro worker thread, so this keeps most of the server thread pool free for other queries
+MAX_WAITERS = 8
+
+
+class ChangeFeed:
+    """Numbers each poll with a monotonically increasing sequence number and records
+       the sequence number at which each parameter last changed value
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._seq = 0
+        self._last_change_seq = 0
+        self._poll_time = None
+        self._values = {}
+        self._changed_seq = {}
+        self._waiters = 0
+
+    def record(self, timestamp, values):
+        """Records a measurement. values is a dictionary keyed by parameter name"""
+        with self._condition:
+            self._seq += 1
+            self._poll_time = timestamp
+            changed = False
+            for name, value in values.items():
+                if name not in self._values or self._values[name] != value:
+                    self._values[name] = value
+                    self._changed_seq[name] = self._seq
+                    changed = True
+
+            if changed:
+                self._last_change_seq = self._seq
+                self._condition.notify_all()
+
+    def retain(self, names):
+        """Forgets the values of any parameters that are not in names (e.g. after a config reload)"""
+        with self._condition:
+            self._values = {k: v for k, v in self._values.items() if k in names}
+            self._changed_seq = {k: v for k, v in self._changed_seq.items() if k in names}
+
+    def changes_since(self, seq, timeout=None):
+        """Returns the parameters that changed after poll seq, waiting up to timeout seconds for a change.
+           A seq that is negative or newer than the latest poll (e.g. from before a daemon restart)
+           returns every parameter. Returns immediately if MAX_WAITERS clients are already waiting.
+           Returns a dictionary with the latest sequence number ('seq'), the time of that poll
+           ('date', unix timestamp), and a dictionary of changed values ('changes').
+        """
+        with self._condition:
+            if seq < 0 or seq > self._seq:
+                seq = 0
+
+            if timeout and self._waiters < MAX_WAITERS:
+                self._waiters += 1
+                try:
+                    deadline = time.monotonic() + min(timeout, MAX_WAIT_TIMEOUT)
+                    while self._last_change_seq <= seq:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiters -= 1
+
+            return {
+                'seq': self._seq,
+                'date': self._poll_time,
+                'changes': {name: self._values[name] for name, s in self._changed_seq.items() if s > seq}
+            }
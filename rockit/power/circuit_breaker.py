@@ -0,0 +1,100 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Circuit breaker that stops unreachable devices from costing a full timeout on every query"""
+
+import random
+import threading
+import time
+
+
+class CircuitBreakerState:
+    """Represents the state of a device circuit breaker"""
+    Closed, Open, HalfOpen = range(3)
+
+    _labels = {
+        0: 'CLOSED',
+        1: 'OPEN',
+        2: 'HALF-OPEN'
+    }
+
+    @classmethod
+    def label(cls, state):
+        """Returns a human readable string describing a state"""
+        return cls._labels.get(state, 'UNKNOWN')
+
+
+class CircuitBreaker:
+    """Tracks consecutive failures for a device
+       After failure_threshold consecutive failures the breaker opens and requests fail immediately.
+       Once the backoff has elapsed a single probe request is let through (half-open): success closes
+       the breaker, and failure reopens it with the backoff doubled (up to backoff_max) plus random jitter.
+    """
+    def __init__(self, failure_threshold=2, backoff_min=5, backoff_max=60, jitter=0.2):
+        self._failure_threshold = failure_threshold
+        self._backoff_min = backoff_min
+        self._backoff_max = backoff_max
+        self._jitter = jitter
+
+        self._lock = threading.Lock()
+        self._state = CircuitBreakerState.Closed
+        self._failures = 0
+        self._backoff = 0
+        self._probe_time = 0
+
+    def allow_request(self):
+        """Returns True if a request should be sent to the device, or False if it should fail fast"""
+        with self._lock:
+            if self._state == CircuitBreakerState.Closed:
+                return True
+
+            if self._state == CircuitBreakerState.Open and time.monotonic() >= self._probe_time:
+                self._state = CircuitBreakerState.HalfOpen
+                return True
+
+            return False
+
+    def record_success(self):
+        """Records a successful request, closing the breaker"""
+        with self._lock:
+            self._state = CircuitBreakerState.Closed
+            self._failures = 0
+            self._backoff = 0
+
+    def record_failure(self):
+        """Records a failed request, opening the breaker if the failure threshold has been reached"""
+        with self._lock:
+            self._failures += 1
+            if self._state == CircuitBreakerState.Closed and self._failures < self._failure_threshold:
+                return
+
+            self._backoff = min(max(2 * self._backoff, self._backoff_min), self._backoff_max)
+            delay = self._backoff * random.uniform(1 - self._jitter, 1 + self._jitter)
+            self._probe_time = time.monotonic() + delay
+            self._state = CircuitBreakerState.Open
+
+    def status(self):
+        """Returns a dictionary describing the breaker state"""
+        with self._lock:
+            next_probe = None
+            if self._state == CircuitBreakerState.Open:
+                next_probe = max(0, self._probe_time - time.monotonic())
+
+            return {
+                'state': self._state,
+                'failures': self._failures,
+                'next_probe': next_probe
+            }
@@ -18,20 +18,13 @@
 
 import json
 from rockit.common import daemons, IP, validation
+from .cache import config_stat, load_cached_config, store_cached_config
 
-from .apc_device import (
-    APCPDUSocketParameter,
-    APCUPSSocketGroupParameter,
-    APCUPSStatusParameter,
-    APCUPSBatteryRemainingParameter,
-    APCUPSBatteryHealthyParameter,
-    APCUPSOutputLoadParameter,
-    APCATSInputSourceParameter)
-from .dummy_device import DummyDevice, DummyUPSDevice
-from .netgear_device import NetgearPoESocketParameter
-from .pyro_switch_device import PyroSwitchDevice
-from .pyro_voltmeter_device import PyroVoltmeterDevice
-from .snmp_device import SNMPDevice
+# Device config keys that set the background poll scheduling (see DevicePoller)
+DEVICE_POLL_KEYS = ['poll_interval', 'fast_poll_interval', 'min_poll_spacing']
+
+# Device config keys that only affect the labels or poll scheduling, so can change without rebuilding the device
+RELOADABLE_DEVICE_KEYS = ['label', 'display_order'] + DEVICE_POLL_KEYS
 
 CONFIG_SCHEMA = {
     'type': 'object',
@@ -62,6 +55,73 @@ CONFIG_SCHEMA = {
                 'type': 'string',
             }
         },
+        'poll_interval': {
+            'type': 'number',
+            'min': 0,
+            'max': 3600
+        },
+        'poll_timeout': {
+            'type': 'number',
+            'min': 0,
+            'max': 60
+        },
+        'history_retention': {
+            'type': 'number',
+            'min': 0
+        },
+        'history_path': {
+            'type': 'string'
+        },
+        'metrics_port': {
+            'type': 'integer',
+            'min': 1,
+            'max': 65535
+        },
+        'shared_snmp_cache': {
+            'type': 'object',
+            'additionalProperties': False,
+            'required': ['max_age'],
+            'properties': {
+                'path': {
+                    'type': 'string'
+                },
+                'max_age': {
+                    'type': 'number',
+                    'min': 0,
+                    'max': 60
+                }
+            }
+        },
+        'coalesce_reads': {
+            'type': 'object',
+            'additionalProperties': False,
+            'properties': {
+                'APCPDU': {
+                    'type': 'boolean'
+                },
+                'APCUPS': {
+                    'type': 'boolean'
+                },
+                'APCATS': {
+                    'type': 'boolean'
+                },
+                'NetgearPOE': {
+                    'type': 'boolean'
+                },
+                'PyroSwitch': {
+                    'type': 'boolean'
+                },
+                'PyroVoltmeter': {
+                    'type': 'boolean'
+                },
+                'Dummy': {
+                    'type': 'boolean'
+                },
+                'DummyUPS': {
+                    'type': 'boolean'
+                }
+            }
+        },
         'devices': {
             'type': 'array',
             'items': {
@@ -75,7 +135,7 @@ CONFIG_SCHEMA = {
                         'enum': [
                             'APCPDU', 'APCUPS', 'APCATS',
                             'NetgearPOE', 'PyroSwitch', 'PyroVoltmeter',
-                            'Dummy', 'DummyUPS'
+                            'Dummy', 'DummyUPS', 'SNMPReplay'
                         ]
                     },
 
@@ -91,6 +151,47 @@ CONFIG_SCHEMA = {
                         'max': 30
                     },
 
+                    # APCPDU, APCUPS, APCATS, NetgearPOE (optional)
+                    # Number of times a SNMP request is resent within query_timeout
+                    'retries': {
+                        'type': 'integer',
+                        'min': 0,
+                        'max': 10
+                    },
+
+                    # APCPDU, APCUPS, APCATS, NetgearPOE (optional)
+                    # UDP port of the SNMP agent (default 161)
+                    'snmp_port': {
+                        'type': 'integer',
+                        'min': 1,
+                        'max': 65535
+                    },
+
+                    # APCPDU, APCUPS, APCATS, NetgearPOE (optional)
+                    # Record all SNMP traffic to this file for later replay using a SNMPReplay device
+                    'capture_path': {
+                        'type': 'string'
+                    },
+
+                    # Used by SNMPReplay
+                    # Replays the SNMP device recorded in a capture_path file
+                    'capture': {
+                        'type': 'string'
+                    },
+
+                    # SNMPReplay (optional)
+                    # Divide the recorded response times by this factor (0 to respond immediately)
+                    'speed': {
+                        'type': 'number',
+                        'min': 0
+                    },
+
+                    # APCPDU, NetgearPOE (optional)
+                    # Fetch outlet/port tables using SNMP v2c GetBulk walks
+                    'bulk_walk': {
+                        'type': 'boolean'
+                    },
+
                     # Used by APCPDU, Dummy
                     'sockets': {
                         'type': 'array',
@@ -107,8 +208,7 @@ CONFIG_SCHEMA = {
                                 },
                                 'socket': {
                                     'type': 'number',
-                                    'min': 1,
-                                    'max': 8
+                                    'min': 1
                                 },
                                 'display_order': {
                                     'type': 'number'
@@ -176,8 +276,7 @@ CONFIG_SCHEMA = {
                                 },
                                 'port': {
                                     'type': 'number',
-                                    'min': 1,
-                                    'max': 24
+                                    'min': 1
                                 },
                                 'display_order': {
                                     'type': 'number'
@@ -189,6 +288,27 @@ CONFIG_SCHEMA = {
                     # NetgearPOE (optional)
                     'community': {
                         'type': 'string'
+                    },
+
+                    # All types (optional)
+                    # Seconds between background polls while the device is reporting normal values
+                    # (default the top-level poll_interval), while it is reporting an abnormal state
+                    # (e.g. on battery, or after a switch command; default 1), and the minimum number
+                    # of seconds between the start of consecutive polls (default 0.5)
+                    'poll_interval': {
+                        'type': 'number',
+                        'min': 0,
+                        'max': 3600
+                    },
+                    'fast_poll_interval': {
+                        'type': 'number',
+                        'min': 0,
+                        'max': 3600
+                    },
+                    'min_poll_spacing': {
+                        'type': 'number',
+                        'min': 0,
+                        'max': 3600
                     }
                 },
                 'anyOf': [
@@ -247,6 +367,14 @@ CONFIG_SCHEMA = {
                             }
                         },
                         'required': ['name', 'label']
+                    },
+                    {
+                        'properties': {
+                            'type': {
+                                'enum': ['SNMPReplay']
+                            }
+                        },
+                        'required': ['capture']
                     }
                 ],
             }
@@ -256,18 +384,31 @@ CONFIG_SCHEMA = {
 
 
 class Config:
-    """Daemon configuration parsed from a json file"""
-    def __init__(self, config_filename):
-        # Will throw on file not found or invalid json
-        with open(config_filename, 'r', encoding='utf-8') as config_file:
-            config_json = json.load(config_file)
-
-        # Will throw on schema violations
-        validation.validate_config(config_json, CONFIG_SCHEMA, {
-            'daemon_name': validation.daemon_name_validator,
-            'machine_name': validation.machine_name_validator
-        })
-
+    """Daemon configuration parsed from a json file
+       Set cache to reuse the result of validating an unchanged config file (used by the commandline tools)
+    """
+    def __init__(self, config_filename, cache=False):
+        self.filename = config_filename
+        config_json = None
+        if cache:
+            stat = config_stat(config_filename)
+            config_json = load_cached_config(config_filename, stat)
+
+        if config_json is None:
+            # Will throw on file not found or invalid json
+            with open(config_filename, 'r', encoding='utf-8') as config_file:
+                config_json = json.load(config_file)
+
+            # Will throw on schema violations
+            validation.validate_config(config_json, CONFIG_SCHEMA, {
+                'daemon_name': validation.daemon_name_validator,
+                'machine_name': validation.machine_name_validator
+            })
+
+            if cache:
+                store_cached_config(config_filename, stat, config_json)
+
+        self.daemon_name = config_json['daemon']
         self.daemon = getattr(daemons, config_json['daemon'])
         self.log_name = config_json['log_name']
         self.control_ips = [getattr(IP, machine) for machine in config_json['control_machines']]
@@ -277,7 +418,37 @@ class Config:
         if 'dashboard_machine' in config_json:
             self.dashboard_ip = getattr(IP, config_json['dashboard_machine'])
 
-        self._device_config = config_json['devices']
+        # Devices are polled in the background every poll_interval seconds,
+        # with a time budget of poll_timeout seconds for querying all devices in parallel
+        self.poll_interval = config_json.get('poll_interval', 5)
+        self.poll_timeout = config_json.get('poll_timeout', 10)
+
+        # Number of seconds of polled measurements to keep in memory
+        self.history_retention = config_json.get('history_retention', 86400)
+
+        # Directory for the long-term on-disk history (disabled if not set)
+        self.history_path = config_json.get('history_path', None)
+
+        # Port for serving OpenMetrics over HTTP (disabled if not set)
+        self.metrics_port = config_json.get('metrics_port', None)
+
+        # Concurrent reads of the same device or parameter share a single query unless disabled by device type
+        self.coalesce_reads = config_json.get('coalesce_reads', {})
+
+        # SNMP get responses can be shared with other daemons on this host for up to max_age seconds
+        self.shared_snmp_cache = config_json.get('shared_snmp_cache', None)
+
+        # Replay devices take the config of the device that was recorded from the capture file
+        self._device_config = []
+        for device in config_json['devices']:
+            if device['type'] == 'SNMPReplay':
+                from .snmp_capture import read_capture_header  # pylint: disable=import-outside-toplevel
+                header = read_capture_header(device['capture'])
+                recorded = {k: v for k, v in header['device'].items() if k != 'capture_path'}
+                recorded['replay'] = {'capture': device['capture'], 'speed': device.get('speed', 1)}
+                recorded.update({k: device[k] for k in DEVICE_POLL_KEYS if k in device})
+                device = recorded
+            self._device_config.append(device)
 
     def get_labels(self):
         """Returns an array mapping parameter names to display labels"""
@@ -313,13 +484,110 @@ class Config:
         labels.sort(key=lambda x: x[3])
         return [{'name': l[0], 'label': l[1], 'type': l[2]} for l in labels]
 
-    def get_devices(self):
-        """Returns a list of devices wrapped by the power daemon"""
+    def __device_key(self, config):
+        """Returns a string that identifies the settings used to construct a device"""
+        def strip(value):
+            if isinstance(value, dict):
+                return {k: strip(v) for k, v in value.items() if k not in RELOADABLE_DEVICE_KEYS}
+            if isinstance(value, list):
+                return [strip(v) for v in value]
+            return value
+
+        return json.dumps([strip(config), self.log_name, self.coalesce_reads.get(config['type'], True),
+                           self.shared_snmp_cache], sort_keys=True)
+
+    def device_keys(self):
+        """Returns a list of strings identifying the settings of each device returned by get_devices
+           Devices with the same key in two configs can be reused without being rebuilt
+        """
+        return [self.__device_key(config) for config in self._device_config]
+
+    def __apply_settings(self, device, config):
+        """Sets the device attributes that can change without rebuilding the device"""
+        device.coalesce_reads = self.coalesce_reads.get(config['type'], True)
+
+        # Unset values use the DevicePoller defaults
+        device.poll_interval = config.get('poll_interval', self.poll_interval)
+        device.fast_poll_interval = config.get('fast_poll_interval')
+        device.min_poll_spacing = config.get('min_poll_spacing')
+
+    def apply_device_settings(self, devices):
+        """Updates the reloadable settings (e.g. poll intervals) of devices returned by get_devices"""
+        for device, config in zip(devices, self._device_config):
+            self.__apply_settings(device, config)
+
+    def get_devices(self, transport=None, existing=None):
+        """Returns a list of devices wrapped by the power daemon
+           SNMP devices use the given SNMPTransport (e.g. shared with other configs) or a new one
+           existing is an optional dictionary of devices keyed by device_keys() (e.g. from the running config)
+           that are returned in place of new devices when their settings have not changed. These are
+           not modified, so keep their current settings until they are passed to apply_device_settings
+        """
+        # Device modules are only needed by the daemon, so aren't loaded by the commandline tools
+        # pylint: disable=import-outside-toplevel
+        from .apc_device import (
+            APCPDUSocketParameter,
+            APCUPSSocketGroupParameter,
+            APCUPSStatusParameter,
+            APCUPSBatteryRemainingParameter,
+            APCUPSBatteryHealthyParameter,
+            APCUPSOutputLoadParameter,
+            APCATSInputSourceParameter)
+        from .dummy_device import DummyDevice, DummyUPSDevice
+        from .netgear_device import NetgearPoESocketParameter
+        from .pyro_proxy import PyroProxy
+        from .pyro_switch_device import PyroSwitchDevice
+        from .pyro_voltmeter_device import PyroVoltmeterDevice
+        from .snmp_cache import DEFAULT_CACHE_PATH, SNMPResponseCache
+        from .snmp_capture import SNMPCapture, SNMPReplayTransport
+        from .snmp_device import SNMPDevice
+        from .snmp_transport import SNMPTransport
+
         ret = []
+
+        # All SNMP devices share a single socket and event loop
+        if transport is None:
+            transport = SNMPTransport()
+
+        cache = None
+        if self.shared_snmp_cache is not None:
+            cache = SNMPResponseCache(self.shared_snmp_cache.get('path', DEFAULT_CACHE_PATH),
+                                      self.shared_snmp_cache['max_age'])
+
+        def snmp_device(config, parameters, **kwargs):
+            device_transport = transport
+            capture = None
+            device_cache = cache
+            if 'replay' in config:
+                device_transport = SNMPReplayTransport(config['replay']['capture'], config['replay']['speed'])
+                device_cache = None
+            elif 'capture_path' in config:
+                capture = SNMPCapture(config['capture_path'], config)
+
+            return SNMPDevice(self.log_name, device_transport, config['ip'], parameters, config['query_timeout'],
+                              retries=config.get('retries', 1), port=config.get('snmp_port', 161),
+                              capture=capture, cache=device_cache, **kwargs)
+
+        # Pyro devices that talk to the same daemon share a single connection,
+        # including the connections held by devices that are reused from the running config
+        reused = [existing[k] for k in self.device_keys() if k in (existing or {})]
+        proxies = {d.proxy.name: d.proxy for d in reused if hasattr(d, 'proxy')}
+
+        def proxy(name):
+            daemon = getattr(daemons, name)
+            if daemon.name not in proxies:
+                proxies[daemon.name] = PyroProxy(daemon)
+            return proxies[daemon.name]
+
         for config in self._device_config:
+            device = (existing or {}).get(self.__device_key(config))
+            if device is not None:
+                ret.append(device)
+                continue
+
             if config['type'] == 'APCPDU':
                 parameters = [APCPDUSocketParameter(s['name'], s['socket']) for s in config['sockets']]
-                ret.append(SNMPDevice(self.log_name, config['ip'], parameters, config['query_timeout']))
+                ret.append(snmp_device(config, parameters, bulk_walk=config.get('bulk_walk', False)))
 
             elif config['type'] == 'APCUPS':
                 parameters = [
@@ -332,34 +600,33 @@ class Config:
                 for g in config.get('groups', []):
                     parameters.append(APCUPSSocketGroupParameter(g['name'], g['group']))
 
-                ret.append(SNMPDevice(self.log_name, config['ip'], parameters, config['query_timeout']))
+                ret.append(snmp_device(config, parameters))
 
             elif config['type'] == 'APCATS':
                 parameters = [
                     APCATSInputSourceParameter(config['name'] + '_source')
                 ]
 
-                ret.append(SNMPDevice(self.log_name, config['ip'], parameters, config['query_timeout']))
+                ret.append(snmp_device(config, parameters))
 
             elif config['type'] == 'NetgearPOE':
                 parameters = [NetgearPoESocketParameter(p['name'], p['port']) for p in config['ports']]
-                ret.append(SNMPDevice(self.log_name, config['ip'], parameters, config['query_timeout'],
-                                      get_community=config.get('community', 'public'),
-                                      set_community=config.get('community', 'private')))
+                ret.append(snmp_device(config, parameters,
+                                       get_community=config.get('community', 'public'),
+                                       set_community=config.get('community', 'private'),
+                                       bulk_walk=config.get('bulk_walk', False)))
 
             elif config['type'] == 'PyroSwitch':
-                ret.append(PyroSwitchDevice(
-                    self.log_name, getattr(daemons, config['daemon']), config['name'], config['query_timeout']
-                ))
+                ret.append(PyroSwitchDevice(self.log_name, proxy(config['daemon']), config['name'],
+                                            config['query_timeout']))
 
             elif config['type'] == 'PyroVoltmeter':
-                ret.append(PyroVoltmeterDevice(
-                    self.log_name, getattr(daemons, config['daemon']), config['name'], config['query_timeout']
-                ))
+                ret.append(PyroVoltmeterDevice(self.log_name, proxy(config['daemon']), config['name'],
+                                               config['query_timeout']))
 
             elif config['type'] == 'Dummy':
                 parameters = [APCPDUSocketParameter(s['name'], s['socket']) for s in config['sockets']]
-                ret.append(DummyDevice(parameters))
+                ret.append(DummyDevice('Dummy', parameters))
 
             elif config['type'] == 'DummyUPS':
                 parameters = [
@@ -369,6 +636,24 @@ class Config:
                     APCUPSOutputLoadParameter(config['name'] + '_load'),
                 ]
 
-                ret.append(DummyUPSDevice(parameters))
+                ret.append(DummyUPSDevice(config['name'], parameters))
+
+            self.__apply_settings(ret[-1], config)
+
+        # The poller and statistics identify devices by name, so devices that would share a name
+        # (e.g. two on the same IP, or two Dummy devices) are given a numbered suffix.
+        # Reused devices keep their existing names
+        names = {d.name for d in reused}
+        for device in ret:
+            if device in reused:
+                continue
+
+            name = device.name
+            suffix = 2
+            while name in names:
+                name = f'{device.name}#{suffix}'
+                suffix += 1
+            device.name = name
+            names.add(name)
 
         return ret
@@ -19,10 +19,19 @@
 
 class Parameter:
     """Data structure encapsulating a switchable port/device"""
+    # numpy dtype used to store values of this parameter in the measurement history
+    history_dtype = 'f4'
+
     def __init__(self, name, error_value):
         self.name = name
         self.error_value = error_value
 
+    def fast_poll_reason(self, value, previous):
+        """Returns a short description if value (compared to the previous value, or None)
+           indicates an abnormal state that should be polled at the device's fast interval
+        """
+        return None
+
 
 class SwitchableParameter:
     pass
@@ -0,0 +1,97 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Locks that serialise access to a physical device, letting writes go ahead of queued reads"""
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+import threading
+
+
+class DeviceLock:
+    """Allows one thread at a time to access a device
+       Threads waiting to write (switch) are always let in before threads waiting to read (poll)
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._busy = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def access(self, write=False):
+        """Context manager that holds the lock for a read or write"""
+        with self._condition:
+            if write:
+                self._waiting_writers += 1
+                try:
+                    while self._busy:
+                        self._condition.wait()
+                finally:
+                    self._waiting_writers -= 1
+            else:
+                while self._busy or self._waiting_writers:
+                    self._condition.wait()
+            self._busy = True
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+
+class AsyncDeviceLock:
+    """Allows one coroutine at a time to access a device from the shared SNMP transport loop
+       Coroutines waiting to write are always let in before coroutines waiting to read
+       Must only be used from a single event loop
+    """
+    def __init__(self):
+        self._busy = False
+        self._writers = deque()
+        self._readers = deque()
+
+    def __release(self):
+        # Hand the lock directly to the next waiter that hasn't been cancelled (e.g. by a timeout)
+        for waiters in (self._writers, self._readers):
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self._busy = False
+
+    @asynccontextmanager
+    async def access(self, write=False):
+        """Async context manager that holds the lock for a read or write"""
+        if self._busy:
+            waiter = asyncio.get_running_loop().create_future()
+            (self._writers if write else self._readers).append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # The lock may have been handed over just before the cancellation
+                if waiter.done() and not waiter.cancelled():
+                    self.__release()
+                raise
+        else:
+            self._busy = True
+
+        try:
+            yield
+        finally:
+            self.__release()
@@ -22,19 +22,27 @@ from .apc_device import (
     APCUPSBatteryRemainingParameter,
     APCUPSBatteryHealthyParameter,
     APCUPSOutputLoadParameter)
+from .device_lock import DeviceLock
 
 
 class DummyUPSDevice:
     """Dummy UPS device for testing"""
-    def __init__(self, parameters):
+    def __init__(self, name, parameters):
         # IP and query_timeout are deliberately ignored
+        self.name = name
         self.parameters = parameters
         self.parameters_by_name = {p.name: p for p in parameters}
+        self._lock = DeviceLock()
 
     def status(self):
         """Return a dictionary of parameter values for this device"""
-        time.sleep(0.2)
-        return {k.name: self.get_parameter(k.name) for k in self.parameters}
+        with self._lock.access():
+            time.sleep(0.2)
+            values = {}
+            for k in self.parameters:
+                time.sleep(0.2)
+                values[k.name] = self.__value(k)
+            return values
 
     def get_parameter(self, parameter_name):
         """Returns the value of a named parameter"""
@@ -42,8 +50,12 @@ class DummyUPSDevice:
         if parameter_name not in self.parameters_by_name:
             return False
 
-        time.sleep(0.2)
-        parameter = self.parameters_by_name[parameter_name]
+        with self._lock.access():
+            time.sleep(0.2)
+            return self.__value(self.parameters_by_name[parameter_name])
+
+    @staticmethod
+    def __value(parameter):
         if isinstance(parameter, APCUPSStatusParameter):
             return 2
 
@@ -62,34 +74,47 @@ class DummyUPSDevice:
         """APC UPSes have no settable parameters"""
         return False
 
+    def set_parameters(self, values):
+        """APC UPSes have no settable parameters"""
+        return {name: False for name in values}
+
 
 class DummyDevice:
     """Dummy device for testing"""
-    def __init__(self, parameters):
+    def __init__(self, name, parameters):
         # IP and query_timeout are deliberately ignored
+        self.name = name
         self.parameters = parameters
         self.parameters_by_name = {p.name: p for p in parameters}
 
         self._state = {p.name: False for p in parameters}
+        self._lock = DeviceLock()
 
     def status(self):
         """Return a dictionary of parameter values for this device"""
-        time.sleep(0.2)
-        return self._state
+        with self._lock.access():
+            time.sleep(0.2)
+            return dict(self._state)
 
     def get_parameter(self, parameter_name):
         """Returns the value of a named parameter"""
         if parameter_name not in self.parameters_by_name:
             return False
 
-        time.sleep(0.2)
-        return self._state[parameter_name]
+        with self._lock.access():
+            time.sleep(0.2)
+            return self._state[parameter_name]
 
     def set_parameter(self, parameter_name, value):
         """Sets the value of a named parameter"""
         if parameter_name not in self._state:
             return False
 
-        time.sleep(0.2)
-        self._state[parameter_name] = value
-        return True
+        with self._lock.access(write=True):
+            time.sleep(0.2)
+            self._state[parameter_name] = value
+            return True
+
+    def set_parameters(self, values):
+        """Sets several named parameters. Returns a dictionary of success flags keyed by parameter name"""
+        return {name: self.set_parameter(name, value) for name, value in values.items()}
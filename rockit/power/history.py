@@ -0,0 +1,131 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fixed-size in-memory history of polled measurements"""
+
+import math
+import threading
+import numpy as np
+
+# Shortest poll interval used when sizing the history (a poll_interval of 0 polls continuously)
+MIN_HISTORY_INTERVAL = 0.1
+
+
+def history_capacity(retention, poll_interval):
+    """Returns the number of samples needed to hold retention seconds of polls made every poll_interval seconds"""
+    return int(math.ceil(retention / max(poll_interval, MIN_HISTORY_INTERVAL))) + 1
+
+
+class MeasurementHistory:
+    """Ring buffer holding the most recent measurements
+       Values are stored column-wise, with one numpy array per parameter using the parameter's history_dtype.
+       Missing values (e.g. a voltmeter that reports None) are stored as NaN in floating point columns.
+    """
+    def __init__(self, parameters, capacity):
+        self._capacity = max(int(capacity), 1)
+        self._times = np.zeros(self._capacity, dtype='f8')
+        self._columns = {p.name: np.zeros(self._capacity, dtype=p.history_dtype) for p in parameters}
+        self._error_values = {p.name: p.error_value for p in parameters}
+        self._lock = threading.Lock()
+
+        # Index of the next sample to write and the number of valid samples
+        self._next = 0
+        self._count = 0
+
+    def set_parameters(self, parameters):
+        """Replaces the recorded parameters (e.g. after a config reload)
+           Columns for parameters that keep the same name and dtype are preserved, and new columns
+           are filled with the parameter's error value for the samples that were recorded before it was added
+        """
+        with self._lock:
+            columns = {}
+            for p in parameters:
+                column = self._columns.get(p.name)
+                if column is None or column.dtype != np.dtype(p.history_dtype):
+                    column = np.zeros(self._capacity, dtype=p.history_dtype)
+                    fill = p.error_value
+                    if fill is None:
+                        fill = np.nan if column.dtype.kind == 'f' else 0
+                    column[:] = fill
+                columns[p.name] = column
+
+            self._columns = columns
+            self._error_values = {p.name: p.error_value for p in parameters}
+
+    def record(self, timestamp, values):
+        """Appends a measurement. values is a dictionary keyed by parameter name"""
+        with self._lock:
+            i = self._next
+            self._times[i] = timestamp
+            for name, column in self._columns.items():
+                value = values.get(name, self._error_values[name])
+                if value is None:
+                    value = np.nan if column.dtype.kind == 'f' else 0
+                column[i] = value
+
+            self._next = (i + 1) % self._capacity
+            self._count = min(self._count + 1, self._capacity)
+
+    def __segments(self):
+        """Returns the (start, end) index ranges of the buffer in chronological order"""
+        if self._count < self._capacity:
+            return [(0, self._count)]
+        return [(self._next, self._capacity), (0, self._next)]
+
+    def query(self, names, start, end, step=None):
+        """Returns the samples recorded between the unix timestamps start and end
+           If step is given the series are decimated to (at most) one sample per step seconds.
+           Returns a dictionary with a 'time' list of unix timestamps and a list of values for each name.
+        """
+        columns = {n: self._columns[n] for n in names if n in self._columns}
+        times = []
+        values = {n: [] for n in columns}
+
+        with self._lock:
+            # Each segment is sorted by time, so the range can be found by bisection on a view
+            ranges = []
+            for seg_start, seg_end in self.__segments():
+                segment = self._times[seg_start:seg_end]
+                lo = np.searchsorted(segment, start, side='left')
+                hi = np.searchsorted(segment, end, side='right')
+                if lo < hi:
+                    ranges.append(np.arange(seg_start + lo, seg_start + hi))
+
+            if ranges:
+                # Buffer indices of the matching samples in chronological order
+                indices = np.concatenate(ranges)
+                if step:
+                    # Pick the first sample in each step-sized bin, with bins aligned to the start time.
+                    # Bins are chosen across the whole range so that a bin spanning the end of the buffer
+                    # doesn't return a sample from each side
+                    selected_times = self._times[indices]
+                    first_bin = start + np.floor((selected_times[0] - start) / step) * step
+                    bins = np.arange(first_bin, selected_times[-1] + step, step)
+                    if len(bins) < len(indices):
+                        selected = np.unique(np.searchsorted(selected_times, bins))
+                        indices = indices[selected[selected < len(indices)]]
+
+                times.extend(self._times[indices].tolist())
+                for name, column in columns.items():
+                    selected = column[indices]
+                    if selected.dtype.kind == 'f':
+                        values[name].extend(None if np.isnan(v) else round(v, 3) for v in selected.tolist())
+                    else:
+                        values[name].extend(selected.tolist())
+
+        ret = {'time': times}
+        ret.update(values)
+        return ret
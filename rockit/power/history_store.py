@@ -0,0 +1,324 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Append-only on-disk measurement history with downsampled rollups"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Each segment file starts with a fixed size header holding the number of committed records.
+# Each record is flushed to disk before the count is incremented and flushed, so a partially written
+# record (e.g. if the daemon is killed or the machine loses power mid-write) is ignored and overwritten
+# after a restart.
+HEADER_MAGIC = b'PWRHIST1'
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('record_size', '<u4'), ('reserved', '<u4'), ('count', '<u8')])
+HEADER_SIZE = 64
+
+# Raw segment files are extended by this many records at a time
+# Rollup segment files are sized to hold a full day of records
+RAW_GROWTH_RECORDS = 4096
+
+# Rollup tiers: name, bin width in seconds, and the tier they are built from
+ROLLUP_TIERS = [('1m', 60, 'raw'), ('1h', 3600, '1m')]
+
+
+class _Segment:
+    """A memory-mapped file of fixed size records covering a single UTC day"""
+    def __init__(self, path, dtype, writable, growth=RAW_GROWTH_RECORDS):
+        self._path = path
+        self._dtype = dtype
+        self._writable = writable
+        self._growth = growth
+        self._header = None
+        self._records = None
+
+        if writable and not os.path.exists(path):
+            with open(path, 'wb') as f:
+                header = np.zeros(1, dtype=HEADER_DTYPE)
+                header['magic'] = HEADER_MAGIC
+                header['record_size'] = dtype.itemsize
+                f.write(header.tobytes().ljust(HEADER_SIZE, b'\0'))
+
+        self._map()
+
+    def _map(self):
+        mode = 'r+' if self._writable else 'r'
+        self._header = np.memmap(self._path, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+        if self._header['magic'][0] != HEADER_MAGIC or self._header['record_size'][0] != self._dtype.itemsize:
+            raise ValueError(f'{self._path} is not a history segment with the expected layout')
+
+        capacity = (os.path.getsize(self._path) - HEADER_SIZE) // self._dtype.itemsize
+        self._records = None
+        if capacity > 0:
+            self._records = np.memmap(self._path, dtype=self._dtype, mode=mode, offset=HEADER_SIZE,
+                                      shape=(capacity,))
+
+    @property
+    def count(self):
+        """Number of committed records, clamped to the file size in case the header is ahead of the data"""
+        capacity = 0 if self._records is None else len(self._records)
+        return min(int(self._header['count'][0]), capacity)
+
+    def records(self):
+        """Returns a read-only view of the committed records. No data is read until the view is accessed"""
+        if self._records is None:
+            return np.zeros(0, dtype=self._dtype)
+        return self._records[:self.count]
+
+    def append(self, record):
+        """Appends a single record (numpy structured scalar/array of length 1)"""
+        count = self.count
+        if self._records is None or count >= len(self._records):
+            self._records = None
+            with open(self._path, 'r+b') as f:
+                f.truncate(HEADER_SIZE + (count + self._growth) * self._dtype.itemsize)
+            self._map()
+
+        self._records[count] = record
+        self._records.flush()
+        self._header['count'] = count + 1
+        self._header.flush()
+
+    def flush(self):
+        """Writes pending changes to disk"""
+        if self._records is not None:
+            self._records.flush()
+        self._header.flush()
+
+
+class HistoryStore:
+    """Stores every polled measurement in daily append-only segment files, and builds
+       1 minute and 1 hour min/mean/max rollups from them on a background thread
+       Files are kept in a subdirectory named by a hash of the parameter layout, so changing
+       the configured parameters starts a new set of files rather than corrupting the old ones
+    """
+    def __init__(self, path, parameters):
+        layout = _layout(parameters)
+        self._path = _layout_path(path, layout)
+        os.makedirs(self._path, exist_ok=True)
+
+        layout_path = os.path.join(self._path, 'layout.json')
+        if not os.path.exists(layout_path):
+            with open(layout_path, 'w', encoding='utf-8') as f:
+                json.dump(layout, f)
+
+        self._names = [p.name for p in parameters]
+        self._dtypes = {
+            'raw': np.dtype([('time', '<f8')] + [(name, dtype) for name, dtype in layout])
+        }
+
+        rollup_fields = [('time', '<f8'), ('count', '<u4')]
+        for name in self._names:
+            rollup_fields += [(name + '_min', '<f4'), (name + '_mean', '<f4'), (name + '_max', '<f4')]
+        self._growth = {}
+        for tier, width, _ in ROLLUP_TIERS:
+            self._dtypes[tier] = np.dtype(rollup_fields)
+            self._growth[tier] = 86400 // width
+
+        self._lock = threading.Lock()
+        self._writers = {}
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Starts the background thread that builds rollups and flushes data to disk"""
+        thread = threading.Thread(target=self.__rollup_loop, daemon=True)
+        thread.start()
+
+    def stop(self):
+        """Flushes data to disk and stops the background thread (e.g. when replaced after a config reload)"""
+        self._stopped.set()
+        with self._lock:
+            for _, segment in self._writers.values():
+                segment.flush()
+
+    def matches(self, path, parameters):
+        """Returns True if this store writes the given parameters to the given path"""
+        return self._path == _layout_path(path, _layout(parameters))
+
+    def __segment_path(self, tier, day):
+        return os.path.join(self._path, f'{tier}-{day:%Y%m%d}.dat')
+
+    def __writer(self, tier, day):
+        """Returns the writable segment for a tier and day, closing segments for earlier days"""
+        writer = self._writers.get(tier)
+        if writer is None or writer[0] != day:
+            if writer is not None:
+                writer[1].flush()
+            growth = self._growth.get(tier, RAW_GROWTH_RECORDS)
+            writer = (day, _Segment(self.__segment_path(tier, day), self._dtypes[tier], True, growth))
+            self._writers[tier] = writer
+        return writer[1]
+
+    def record(self, timestamp, values):
+        """Appends a measurement. values is a dictionary keyed by parameter name"""
+        record = np.zeros(1, dtype=self._dtypes['raw'])
+        record['time'] = timestamp
+        for name in self._names:
+            value = values.get(name)
+            if value is None:
+                value = np.nan if record.dtype[name].kind == 'f' else 0
+            record[name] = value
+
+        day = datetime.datetime.utcfromtimestamp(timestamp).date()
+        with self._lock:
+            self.__writer('raw', day).append(record[0])
+
+    def __segments(self, tier, start, end):
+        """Yields read-only record views for each day overlapping [start, end]"""
+        # File names sort chronologically within a tier
+        first = os.path.basename(self.__segment_path(tier, datetime.datetime.utcfromtimestamp(max(start, 0))))
+        last = os.path.basename(self.__segment_path(tier, datetime.datetime.utcfromtimestamp(min(end, 2 ** 33))))
+        for filename in sorted(os.listdir(self._path)):
+            if filename.startswith(tier + '-') and first <= filename <= last:
+                yield _Segment(os.path.join(self._path, filename), self._dtypes[tier], False).records()
+
+    def query(self, names, start, end, resolution='raw'):
+        """Returns the records for the given parameters between the unix timestamps start and end.
+           resolution is 'raw', '1m', or '1h'. Raw queries return a list of values for each name;
+           rollup queries return a dictionary of 'min', 'mean', 'max' lists for each name.
+        """
+        if resolution not in self._dtypes:
+            raise ValueError(f'Unknown history resolution {resolution}')
+
+        names = [n for n in names if n in self._names]
+        ret = {'time': []}
+        for name in names:
+            ret[name] = [] if resolution == 'raw' else {'min': [], 'mean': [], 'max': []}
+
+        for records in self.__segments(resolution, start, end):
+            # Bisection only touches the pages of the memory-map that are needed
+            times = records['time']
+            lo = np.searchsorted(times, start, side='left')
+            hi = np.searchsorted(times, end, side='right')
+            selected = records[lo:hi]
+            ret['time'].extend(selected['time'].tolist())
+            for name in names:
+                if resolution == 'raw':
+                    ret[name].extend(_to_list(selected[name]))
+                else:
+                    for stat in ['min', 'mean', 'max']:
+                        ret[name][stat].extend(_to_list(selected[name + '_' + stat]))
+        return ret
+
+    def __last_time(self, tier):
+        """Returns the time of the newest record in a tier, or None if there are none"""
+        files = sorted(f for f in os.listdir(self._path) if f.startswith(tier + '-'))
+        for filename in reversed(files):
+            records = _Segment(os.path.join(self._path, filename), self._dtypes[tier], False).records()
+            if len(records):
+                return float(records['time'][-1])
+        return None
+
+    def __rollup(self, tier, width, source):
+        """Builds rollup records for every complete bin since the newest existing rollup"""
+        last = self.__last_time(tier)
+        if last is None:
+            last = self.__first_time(source)
+            if last is None:
+                return
+            start = np.floor(last / width) * width
+        else:
+            start = last + width
+
+        end = np.floor(time.time() / width) * width
+        if start >= end:
+            return
+
+        for records in self.__segments(source, start, end):
+            times = records['time']
+            selected = records[np.searchsorted(times, start, side='left'):np.searchsorted(times, end, side='left')]
+            if not len(selected):
+                continue
+
+            bins = np.floor(selected['time'] / width) * width
+            offsets = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+            rollup = np.zeros(len(offsets), dtype=self._dtypes[tier])
+            rollup['time'] = bins[offsets]
+
+            if source == 'raw':
+                counts = np.diff(np.r_[offsets, len(selected)])
+                rollup['count'] = counts
+                for name in self._names:
+                    values = selected[name].astype('f8')
+                    rollup[name + '_min'] = np.fmin.reduceat(values, offsets)
+                    rollup[name + '_max'] = np.fmax.reduceat(values, offsets)
+                    rollup[name + '_mean'] = _nanmean_reduceat(values, offsets, np.ones(len(values)))
+            else:
+                weights = selected['count'].astype('f8')
+                rollup['count'] = np.add.reduceat(selected['count'], offsets)
+                for name in self._names:
+                    rollup[name + '_min'] = np.fmin.reduceat(selected[name + '_min'].astype('f8'), offsets)
+                    rollup[name + '_max'] = np.fmax.reduceat(selected[name + '_max'].astype('f8'), offsets)
+                    rollup[name + '_mean'] = _nanmean_reduceat(selected[name + '_mean'].astype('f8'),
+                                                               offsets, weights)
+
+            with self._lock:
+                for r in rollup:
+                    day = datetime.datetime.utcfromtimestamp(r['time']).date()
+                    self.__writer(tier, day).append(r)
+
+    def __first_time(self, tier):
+        files = sorted(f for f in os.listdir(self._path) if f.startswith(tier + '-'))
+        for filename in files:
+            records = _Segment(os.path.join(self._path, filename), self._dtypes[tier], False).records()
+            if len(records):
+                return float(records['time'][0])
+        return None
+
+    def __rollup_loop(self):
+        while not self._stopped.is_set():
+            try:
+                for tier, width, source in ROLLUP_TIERS:
+                    self.__rollup(tier, width, source)
+
+                with self._lock:
+                    for _, segment in self._writers.values():
+                        segment.flush()
+            except Exception as exception:
+                print(f'{datetime.datetime.utcnow()} ERROR: failed to update history rollups: {exception}')
+
+            self._stopped.wait(60 - time.time() % 60 + 1)
+
+
+def _layout(parameters):
+    """Returns the list of [name, dtype] pairs that define the record layout for a set of parameters"""
+    return [[p.name, np.dtype(p.history_dtype).str] for p in parameters]
+
+
+def _layout_path(path, layout):
+    """Returns the subdirectory of path that holds the files for a record layout"""
+    return os.path.join(path, hashlib.sha1(json.dumps(layout).encode('utf-8')).hexdigest()[:12])
+
+
+def _nanmean_reduceat(values, offsets, weights):
+    """Weighted mean of each group starting at offsets, ignoring NaN values"""
+    valid = ~np.isnan(values)
+    totals = np.add.reduceat(np.where(valid, values * weights, 0), offsets)
+    counts = np.add.reduceat(np.where(valid, weights, 0), offsets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts
+
+
+def _to_list(values):
+    """Converts a numpy array to a list, replacing NaN with None"""
+    if values.dtype.kind == 'f':
+        return [None if np.isnan(v) else round(v, 3) for v in values.tolist()]
+    return values.tolist()
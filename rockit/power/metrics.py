@@ -0,0 +1,173 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""OpenMetrics (Prometheus) exporter for the cached poll data"""
+
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+from .constants import SwitchStatus
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Gauges exported for each parameter type: metric suffix, parameter name suffix, and help text
+GAUGES = {
+    'switch': [
+        ('switch_state', '', 'Switch state (1 = on, 0 = off)')
+    ],
+    'voltage': [
+        ('voltage_volts', '', 'Measured voltage')
+    ],
+    'ups': [
+        ('ups_status', '_status', 'UPS status code (see APCUPSStatus)'),
+        ('ups_battery_remaining_percent', '_battery_remaining', 'UPS battery charge remaining'),
+        ('ups_battery_healthy', '_battery_healthy', 'UPS battery health (1 = healthy, 0 = replace battery)'),
+        ('ups_load_percent', '_load', 'UPS output load')
+    ],
+    'ats': [
+        ('ats_source', '_source', 'ATS input source (0 = unknown)')
+    ]
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def render_metrics(labels, samples, device_stats, method_stats, coalesced=None):
+    """Formats the cached measurements and query statistics as OpenMetrics text
+       labels is the list returned by Config.get_labels, samples is a dictionary of (value, sample time)
+       tuples keyed by parameter name, device_stats is a dictionary of PerformanceStats keyed by device name,
+       method_stats is the PerformanceStats for the daemon methods, and coalesced is a dictionary of the
+       number of reads that shared an in-progress query keyed by device name
+    """
+    lines = []
+    families = {}
+    for label in labels:
+        for metric, suffix, _ in GAUGES.get(label['type'], []):
+            sample = samples.get(label['name'] + suffix)
+            if sample is None:
+                continue
+
+            value = sample[0]
+            if label['type'] == 'switch':
+                value = None if value == SwitchStatus.Unknown else value == SwitchStatus.On
+            families.setdefault(metric, []).append(
+                f'power_{metric}{_labels(name=label["name"], label=label["label"])} {_format_value(value)}')
+
+    for gauges in GAUGES.values():
+        for metric, _, description in gauges:
+            if metric in families:
+                lines.append(f'# TYPE power_{metric} gauge')
+                lines.append(f'# HELP power_{metric} {description}')
+                lines.extend(families.pop(metric))
+
+    if samples:
+        lines.append('# TYPE power_sample_timestamp_seconds gauge')
+        lines.append('# HELP power_sample_timestamp_seconds Time that each parameter was last measured')
+        for name, (_, sample_time) in samples.items():
+            lines.append(f'power_sample_timestamp_seconds{_labels(name=name)} {sample_time!r}')
+
+    device_histograms = {name: stats.histograms() for name, stats in device_stats.items()}
+    lines.extend(_render_histograms('device_query', 'Latency of device queries', [
+        ({'device': name, 'operation': operation}, histogram)
+        for name, operations in device_histograms.items() for operation, histogram in operations.items()]))
+    lines.extend(_render_histograms('method_call', 'Latency of powerd method calls', [
+        ({'method': method}, histogram) for method, histogram in method_stats.histograms().items()]))
+
+    if coalesced:
+        lines.append('# TYPE power_device_coalesced_reads counter')
+        lines.append('# HELP power_device_coalesced_reads Number of reads that shared a query already in progress')
+        for name, count in coalesced.items():
+            lines.append(f'power_device_coalesced_reads_total{_labels(device=name)} {count}')
+
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def _render_histograms(metric, description, series):
+    """Formats a latency histogram and failure counter family from a list of (labels, histogram) pairs"""
+    lines = [
+        f'# TYPE power_{metric}_duration_seconds histogram',
+        f'# UNIT power_{metric}_duration_seconds seconds',
+        f'# HELP power_{metric}_duration_seconds {description}'
+    ]
+
+    for labels, histogram in series:
+        for bound, count in histogram['buckets']:
+            lines.append(f'power_{metric}_duration_seconds_bucket{_labels(**labels, le=repr(bound))} {count}')
+        lines.append(f'power_{metric}_duration_seconds_bucket{_labels(**labels, le="+Inf")} {histogram["count"]}')
+        lines.append(f'power_{metric}_duration_seconds_count{_labels(**labels)} {histogram["count"]}')
+        lines.append(f'power_{metric}_duration_seconds_sum{_labels(**labels)} {histogram["sum"]!r}')
+
+    lines.append(f'# TYPE power_{metric}_failures counter')
+    lines.append(f'# HELP power_{metric}_failures Number of failures by reason')
+    for labels, histogram in series:
+        for reason in ['errors', 'timeouts', 'parse_errors']:
+            lines.append(f'power_{metric}_failures_total{_labels(**labels, reason=reason)} {histogram[reason]}')
+    return lines
+
+
+class MetricsServer:
+    """Serves /metrics over HTTP on a background thread
+       render is called for each scrape and must return the metrics text without querying any hardware
+    """
+    def __init__(self, port, render):
+        render_metrics_text = render
+
+        class Handler(BaseHTTPRequestHandler):
+            """Handles a single scrape request"""
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                try:
+                    body = render_metrics_text().encode('utf-8')
+                except Exception as exception:
+                    print(f'{datetime.datetime.utcnow()} ERROR: failed to render metrics: {exception}')
+                    self.send_error(500)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                # Don't print a line for every scrape
+                pass
+
+        self._server = ThreadingHTTPServer(('', port), Handler)
+        self._server.daemon_threads = True
+
+    def start(self):
+        """Starts serving requests"""
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
@@ -17,25 +17,31 @@
 """Netgear-specific parameters for SNMPDevice"""
 
 from .constants import SwitchStatus, SwitchableParameter
+from .snmp import Integer
 from .snmp_device import SNMPParameter
 
+POE_PORT_DETECTION_STATUS_COLUMN = '.1.3.6.1.2.1.105.1.1.1.6.1'
+
 
 class NetgearPoESocketParameter(SNMPParameter, SwitchableParameter):
     """Data structure encapsulating a PoE parameter"""
+    history_dtype = 'u1'
+
     def __init__(self, name, port):
-        get_oid = '.1.3.6.1.2.1.105.1.1.1.6.1.' + str(port)
+        get_oid = POE_PORT_DETECTION_STATUS_COLUMN + '.' + str(port)
         set_oid = '.1.3.6.1.2.1.105.1.1.1.3.1.' + str(port)
-        SNMPParameter.__init__(self, name, get_oid, set_oid, SwitchStatus.Unknown)
+        SNMPParameter.__init__(self, name, get_oid, set_oid, SwitchStatus.Unknown,
+                               column_oid=POE_PORT_DETECTION_STATUS_COLUMN, row_index=str(port))
         self.port = port
 
-    def parse_snmpget_output(self, output):
-        """Convert a snmpget output string for this parameter into a python value"""
-        return SwitchStatus.On if int(output.split(' ')[-1]) == 3 else SwitchStatus.Off
+    def parse_get_value(self, value):
+        """Convert a value returned by a SNMP get for this parameter into a python value"""
+        return SwitchStatus.On if int(value) == 3 else SwitchStatus.Off
 
-    def parse_snmpset_output(self, output):
-        """Convert a snmpset output string for this parameter into a python value"""
-        return SwitchStatus.On if int(output.split(' ')[-1]) == 1 else SwitchStatus.Off
+    def parse_set_value(self, value):
+        """Convert a value returned by a SNMP set for this parameter into a python value"""
+        return SwitchStatus.On if int(value) == 1 else SwitchStatus.Off
 
     def format_set_value(self, value):
-        """Format a python value to a string to send via SNMP"""
-        return '1' if value == SwitchStatus.On else '2'
+        """Format a python value to send via SNMP"""
+        return Integer(1 if value == SwitchStatus.On else 2)
@@ -0,0 +1,569 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Background polling of devices into a cached measurement snapshot"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import datetime
+import threading
+import time
+from .stats import Outcome, PerformanceStats
+
+# Upper limit on the number of pollers that a PollScheduler polls at the same time
+MAX_CONCURRENT_POLLS = 32
+
+# Default per-device poll settings (overridden by the device's poll_interval, fast_poll_interval,
+# and min_poll_spacing attributes). The normal interval defaults to the poller's poll_interval
+DEFAULT_FAST_POLL_INTERVAL = 1
+DEFAULT_MIN_POLL_SPACING = 0.5
+
+# Devices are polled at their fast interval for this many seconds after a switch command
+SWITCH_FAST_POLL_DURATION = 30
+
+# Number of consecutive normal polls before a fast polled device starts to slow down again
+SETTLE_POLLS = 3
+
+
+class _SingleFlight:
+    """Runs at most one call at a time for each key, sharing the result with any concurrent callers"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def call(self, key, function):
+        """Returns (result of function, True if the result was shared from a call already in progress)"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                shared = True
+            else:
+                shared = False
+                future = self._calls[key] = Future()
+
+        if shared:
+            return future.result(), True
+
+        try:
+            future.set_result(function())
+        except Exception as exception:
+            future.set_exception(exception)
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+        return future.result(), False
+
+
+class _PollRate:
+    """Chooses the poll interval of a single device from the values that it reports
+       The interval drops to the fast interval as soon as any parameter reports an abnormal state
+       (or a switch command is sent), and after SETTLE_POLLS consecutive normal polls doubles on
+       each poll until it is back at the normal interval. It is never shorter than the minimum spacing.
+    """
+    def __init__(self, device, default_interval):
+        self.normal = self.fast = self.min_spacing = self.interval = None
+        self.reason = None
+        self.configure(device, default_interval)
+        self._settled = 0
+        self._switched_until = 0
+        self._previous = {}
+
+    def configure(self, device, default_interval):
+        """Reads the poll settings from the device (e.g. after a config reload)"""
+        def setting(name, default):
+            value = getattr(device, name, None)
+            return default if value is None else value
+
+        self.normal = setting('poll_interval', default_interval)
+        self.fast = min(setting('fast_poll_interval', DEFAULT_FAST_POLL_INTERVAL), self.normal)
+        self.min_spacing = setting('min_poll_spacing', DEFAULT_MIN_POLL_SPACING)
+
+        # A device that isn't tracking an abnormal state follows changes to its normal interval
+        if self.reason is None:
+            self.interval = self.normal
+
+    def current(self):
+        """Returns the number of seconds between the starts of consecutive polls"""
+        return max(min(self.interval, self.normal), self.min_spacing)
+
+    def switched(self):
+        """Switches to the fast interval after a switch command"""
+        self._switched_until = time.monotonic() + SWITCH_FAST_POLL_DURATION
+        self.interval = self.fast
+        self.reason = 'recently switched'
+        self._settled = 0
+
+    def update(self, device, values):
+        """Updates the interval from the values returned by a successful device query"""
+        # A query that fails reports the error value for every parameter, which says nothing about the device
+        if all(values.get(p.name) == p.error_value for p in device.parameters):
+            return
+
+        reasons = []
+        for p in device.parameters:
+            if p.name in values:
+                reason = p.fast_poll_reason(values[p.name], self._previous.get(p.name))
+                if reason is not None and reason not in reasons:
+                    reasons.append(reason)
+        self._previous.update(values)
+
+        if time.monotonic() < self._switched_until:
+            reasons.append('recently switched')
+
+        if reasons:
+            self.interval = self.fast
+            self.reason = ', '.join(reasons)
+            self._settled = 0
+        elif self.interval < self.normal:
+            self._settled += 1
+            if self._settled >= SETTLE_POLLS:
+                self.interval = min(self.interval * 2, self.normal)
+            self.reason = 'settling' if self.interval < self.normal else None
+
+
+class PollScheduler:
+    """Runs the background polls for one or more DevicePollers (e.g. several configs hosted by one process)
+       from a single planning thread. Each poller is polled again when its next device is due (see
+       DevicePoller.next_poll_time), and a poller that is still waiting for its devices is never started twice.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_poll = {}
+        self._running = set()
+
+        # Each poll blocks its worker for up to the poll timeout. Workers are only created when
+        # needed, so this only limits the number of pollers that can wait on their devices at once
+        self._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_POLLS)
+
+    def add(self, poller):
+        """Schedules a poller to be polled immediately and then whenever its next device is due
+           Also used to wake the scheduler when a device's next poll has been brought forward
+        """
+        with self._condition:
+            self._next_poll[poller] = time.monotonic()
+            self._condition.notify_all()
+
+    def start(self):
+        """Starts the planning thread"""
+        thread = threading.Thread(target=self.__run, daemon=True)
+        thread.start()
+
+    def __poll(self, poller):
+        try:
+            poller.poll()
+        except Exception as exception:
+            print(f'{datetime.datetime.utcnow()} ERROR: background poll failed: {exception}')
+
+        with self._condition:
+            self._next_poll[poller] = poller.next_poll_time()
+            self._running.discard(poller)
+            self._condition.notify_all()
+
+    def __run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                due = [p for p, t in self._next_poll.items() if t <= now and p not in self._running]
+                if not due:
+                    waiting = [t for p, t in self._next_poll.items() if p not in self._running]
+                    self._condition.wait(max(0, min(waiting) - now) if waiting else None)
+                    continue
+
+                self._running.update(due)
+
+            for poller in due:
+                self._executor.submit(self.__poll, poller)
+
+
+class DevicePoller:
+    """Queries devices in parallel on a background loop and caches the latest value of each parameter
+       Each device is polled at its own interval, which shortens while the device reports an abnormal state
+       Pollers for several configs can share an executor for the threaded (non-SNMP) device queries
+    """
+    def __init__(self, devices, poll_interval, poll_timeout, executor=None):
+        self._devices = devices
+        self.poll_interval = poll_interval
+        self._poll_timeout = poll_timeout
+        self._device_by_parameter = {p.name: d for d in devices for p in d.parameters}
+
+        # Devices are queried in parallel so that a slow or unreachable device
+        # only costs the poll timeout once rather than adding to every other device
+        if executor is None:
+            threaded_devices = [d for d in devices if not hasattr(d, 'status_future')]
+            executor = ThreadPoolExecutor(max_workers=max(len(threaded_devices), 1))
+        self._executor = executor
+        self._pending_polls = {}
+        self._poll_started = {}
+
+        # Poll interval and next due time (time.monotonic) of each device
+        self._rates = {d: _PollRate(d, poll_interval) for d in devices}
+        self._next_due = {d: 0 for d in devices}
+        self._scheduler = None
+
+        # Listeners are notified once every poll_interval seconds (a tick) with the latest samples, however
+        # often and however slowly the devices are polled. Devices at their normal rate are polled on the ticks
+        # so that each notification holds the values from the previous tick's poll
+        self._next_tick = 0
+
+        # Concurrent reads of a device or parameter share a single query (unless device.coalesce_reads is False)
+        self._reads = _SingleFlight()
+        self._coalesced = {}
+
+        # Latest value and sample time (unix timestamp) of each parameter
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._timed_out = set()
+        self._last_poll_time = None
+
+        # Duration of each background round of queries, with the outcome recording whether any device timed out
+        self.stats = PerformanceStats()
+
+        # Functions that are called with (poll time, values dictionary) on each tick
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Registers a function to be called with (poll time, values dictionary) on each tick"""
+        # The list is replaced rather than modified so that a poll in progress isn't affected
+        self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        """Unregisters a function that was registered by add_listener"""
+        self._listeners = [c for c in self._listeners if c != callback]
+
+    def set_devices(self, devices, poll_interval, poll_timeout):
+        """Replaces the polled devices (e.g. after a config reload)
+           The cached values of devices that appear in both lists are kept, and
+           late results from devices that have been removed are discarded
+        """
+        with self._lock:
+            self._devices = devices
+            self._device_by_parameter = {p.name: d for d in devices for p in d.parameters}
+            self.poll_interval = poll_interval
+            self._poll_timeout = poll_timeout
+
+            names = {d.name for d in devices}
+            self._samples = {k: v for k, v in self._samples.items() if k in self._device_by_parameter}
+            self._timed_out &= names
+            self._pending_polls = {d: f for d, f in self._pending_polls.items() if d in devices}
+            self._poll_started = {d: t for d, t in self._poll_started.items() if d in devices}
+            self._coalesced = {k: v for k, v in self._coalesced.items() if k in names}
+
+            # New devices are polled immediately
+            self._rates = {d: self._rates.get(d) or _PollRate(d, poll_interval) for d in devices}
+            for device, rate in self._rates.items():
+                rate.configure(device, poll_interval)
+            self._next_due = {d: self._next_due.get(d, 0) for d in devices}
+
+        self.__wake()
+
+    def start(self, scheduler=None):
+        """Starts background polling, using a shared PollScheduler if given"""
+        if scheduler is None:
+            scheduler = PollScheduler()
+            scheduler.add(self)
+            scheduler.start()
+        else:
+            scheduler.add(self)
+        self._scheduler = scheduler
+
+    def __wake(self):
+        """Asks the scheduler to check for devices that are now due"""
+        if self._scheduler is not None:
+            self._scheduler.add(self)
+
+    def next_poll_time(self):
+        """Returns the time.monotonic() value when the next device is due to be polled"""
+        with self._lock:
+            return min(list(self._next_due.values()) + [self._next_tick])
+
+    def __align(self, due):
+        """Returns the tick nearest to a due time. Must be called with self._lock held"""
+        if self.poll_interval <= 0:
+            return due
+        ticks = max(round((due - self._next_tick) / self.poll_interval), 0)
+        return self._next_tick + ticks * self.poll_interval
+
+    def __schedule(self, device, start):
+        """Returns the next due time of a device polled at start. Must be called with self._lock held"""
+        rate = self._rates[device]
+        due = start + rate.current()
+        return self.__align(due) if rate.interval >= rate.normal else due
+
+    def poll_rate(self, device):
+        """Returns a dictionary of the device's current poll 'interval' and 'normal_interval' in seconds, and
+           the 'reason' for polling at the fast rate (the abnormal state that is being tracked, or None)
+        """
+        with self._lock:
+            rate = self._rates.get(device)
+            if rate is None:
+                return {'interval': None, 'normal_interval': None, 'reason': None}
+            return {'interval': rate.current(), 'normal_interval': rate.normal, 'reason': rate.reason}
+
+    def __store_status(self, device, future):
+        """Updates the snapshot with the result of a completed device query"""
+        if future.exception() is None:
+            values = future.result()
+        else:
+            values = {p.name: p.error_value for p in device.parameters}
+
+        sample_time = time.time()
+        wake = False
+        with self._lock:
+            if device not in self._devices:
+                return
+
+            self._timed_out.discard(device.name)
+            for name, value in values.items():
+                self._samples[name] = (value, sample_time)
+
+            if future.exception() is None:
+                # Bring the next poll forward if the device has switched to a faster rate
+                self._rates[device].update(device, values)
+                due = self.__schedule(device, self._poll_started.get(device, 0))
+                if due < self._next_due[device]:
+                    self._next_due[device] = due
+                    wake = True
+
+        if wake:
+            self.__wake()
+
+    def __coalesce(self, device):
+        return getattr(device, 'coalesce_reads', True)
+
+    def __count_coalesced(self, device):
+        """Must be called with self._lock held"""
+        self._coalesced[device.name] = self._coalesced.get(device.name, 0) + 1
+
+    def __submit_poll(self, device, coalesce=True):
+        """Returns a future for the status of a device, reusing a query that is already in progress
+           so that a hung device can't accumulate blocked worker threads across repeated polls
+        """
+        with self._lock:
+            future = self._pending_polls.get(device)
+            if coalesce and future is not None and not future.done():
+                self.__count_coalesced(device)
+                return future
+
+            # SNMP devices are queried together on the shared transport loop instead of a worker thread
+            if hasattr(device, 'status_future'):
+                future = device.status_future()
+            else:
+                future = self._executor.submit(device.status)
+            self._pending_polls[device] = future
+            self._poll_started[device] = time.monotonic()
+
+        # Registered outside the lock because the callback runs immediately if the query has already finished
+        future.add_done_callback(lambda f: self.__store_status(device, f))
+        return future
+
+    def poll(self, devices=None):
+        """Queries the given devices and blocks until they respond or the poll timeout expires
+           If devices is not given, runs a background poll: notifies the listeners if a tick is due, and then
+           queries the devices that are due, waiting until they respond, the poll timeout expires, or the next
+           tick or another device becomes due.
+           The background poll never starts a second query to a device that is still responding, but
+           on-demand polls of specific devices start a new query for devices that have disabled coalesce_reads
+        """
+        if devices is not None:
+            futures = {device: self.__submit_poll(device, self.__coalesce(device)) for device in devices}
+            wait(futures.values(), timeout=self._poll_timeout)
+            with self._lock:
+                self.__mark_timed_out(futures, time.time())
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            due = [d for d in self._devices if self._next_due[d] <= now]
+            tick = self._next_tick <= now
+            if not due and not tick:
+                return
+
+            if tick:
+                # Missed ticks (e.g. the first) are skipped rather than run back to back
+                self._next_tick += self.poll_interval
+                if self._next_tick <= now:
+                    self._next_tick = now + self.poll_interval
+
+            for device in due:
+                self._next_due[device] = self.__schedule(device, now)
+
+            # A device whose previous query is still in progress is polled again as soon as it completes
+            due = [d for d in due if d not in self._pending_polls or self._pending_polls[d].done()]
+
+        # Listeners receive the latest samples at the tick itself, so a slow device can't delay them
+        if tick:
+            self.__notify()
+
+        if not due:
+            return
+
+        start = time.perf_counter()
+        futures = {device: self.__submit_poll(device) for device in due}
+        self.__wait_for_round(futures)
+
+        with self._lock:
+            timed_out = self.__mark_timed_out(futures, time.time(), background=True)
+        self.stats.record('poll', time.perf_counter() - start, Outcome.Timeout if timed_out else Outcome.Success)
+
+    def __mark_timed_out(self, futures, sample_time, background=False):
+        """Reports the error values for queries that haven't responded within the poll timeout
+           Background checks skip queries that were started less than poll_timeout seconds ago
+           Returns True if any device timed out. Must be called with self._lock held
+        """
+        now = time.monotonic()
+        timed_out = False
+        for device, future in futures.items():
+            if future.done() or device not in self._devices:
+                continue
+
+            if background and now - self._poll_started[device] < self._poll_timeout:
+                continue
+
+            # The late result will replace these once the query completes
+            timed_out = True
+            self._timed_out.add(device.name)
+            for p in device.parameters:
+                self._samples[p.name] = (p.error_value, sample_time)
+        return timed_out
+
+    def __notify(self):
+        """Calls the listeners with the latest value of every parameter"""
+        sample_time = time.time()
+        with self._lock:
+            # Queries that were started by earlier polls may have timed out since
+            self.__mark_timed_out(self._pending_polls, sample_time, background=True)
+            self._last_poll_time = sample_time
+            values = {name: sample[0] for name, sample in self._samples.items()}
+
+        for callback in self._listeners:
+            try:
+                callback(sample_time, values)
+            except Exception as exception:
+                print(f'{datetime.datetime.utcnow()} ERROR: failed to process measurement: {exception}')
+
+    def __wait_for_round(self, futures):
+        """Waits until the queries of a background poll have completed or the poll timeout expires
+           Returns early if the next tick or a device that isn't being queried becomes due, so that a slow
+           device can't hold up the listeners or the next poll of a device that is being polled at a faster rate
+        """
+        deadline = time.monotonic() + self._poll_timeout
+        while True:
+            not_done = [f for f in futures.values() if not f.done()]
+            if not not_done:
+                return
+
+            with self._lock:
+                idle = [self._next_tick] + [t for d, t in self._next_due.items()
+                                            if d not in self._pending_polls or self._pending_polls[d].done()]
+
+            timeout = min([deadline] + idle) - time.monotonic()
+            if timeout <= 0:
+                return
+
+            wait(not_done, timeout=timeout, return_when=FIRST_COMPLETED)
+
+    def __stale_devices(self, names, max_age):
+        """Returns the devices holding parameters that are missing or older than max_age"""
+        now = time.time()
+        stale = []
+        with self._lock:
+            for name in names:
+                sample = self._samples.get(name)
+                if sample is None or (max_age is not None and now - sample[1] > max_age):
+                    # Parameters may have been removed by a config reload since the caller checked them
+                    device = self._device_by_parameter.get(name)
+                    if device is not None and device not in stale:
+                        stale.append(device)
+        return stale
+
+    def measurement(self, max_age=None):
+        """Returns the cached value of every parameter, refreshing any older than max_age seconds"""
+        stale = self.__stale_devices(self._device_by_parameter, max_age)
+        if stale:
+            self.poll(stale)
+
+        with self._lock:
+            data = {name: sample[0] for name, sample in self._samples.items()}
+            data['timed_out'] = sorted(self._timed_out)
+            data['date'] = self._last_poll_time
+            if data['date'] is None:
+                data['date'] = min((s[1] for s in self._samples.values()), default=time.time())
+        return data
+
+    def samples(self):
+        """Returns a dictionary of (value, sample time) tuples keyed by parameter name"""
+        with self._lock:
+            return dict(self._samples)
+
+    def value(self, name, max_age=None):
+        """Returns the cached value of a parameter, querying the device if it is older than max_age seconds"""
+        stale = self.__stale_devices([name], max_age)
+        if stale:
+            device = stale[0]
+            if not self.__coalesce(device):
+                value = device.get_parameter(name)
+                self.update(name, value)
+                return value
+
+            # A status query that is already in progress will return a fresh value for the parameter
+            with self._lock:
+                pending = self._pending_polls.get(device)
+                if pending is not None and not pending.done():
+                    self.__count_coalesced(device)
+                else:
+                    pending = None
+
+            if pending is not None:
+                try:
+                    return pending.result(timeout=self._poll_timeout)[name]
+                except Exception:
+                    return device.parameters_by_name[name].error_value
+
+            value, shared = self._reads.call(name, lambda: device.get_parameter(name))
+            if shared:
+                with self._lock:
+                    self.__count_coalesced(device)
+            else:
+                self.update(name, value)
+            return value
+
+        with self._lock:
+            sample = self._samples.get(name)
+            return sample[0] if sample is not None else False
+
+    def coalesced_reads(self):
+        """Returns the number of reads that shared a query already in progress, keyed by device name"""
+        with self._lock:
+            return dict(self._coalesced)
+
+    def update(self, name, value, switched=False):
+        """Records a value that has been read or set outside the polling loop
+           Set switched after a switch command to poll the device at its fast rate for a while
+        """
+        with self._lock:
+            device = self._device_by_parameter.get(name)
+            if device is None:
+                return
+
+            self._samples[name] = (value, time.time())
+            if switched:
+                rate = self._rates[device]
+                rate.switched()
+                self._next_due[device] = min(self._next_due[device],
+                                             self._poll_started.get(device, 0) + rate.current())
+
+        if switched:
+            self.__wake()
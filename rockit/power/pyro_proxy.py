@@ -0,0 +1,104 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Long-lived connection to a remote Pyro daemon shared by the devices that query it"""
+
+import threading
+import time
+from .device_lock import DeviceLock
+from .stats import PerformanceStats, outcome_for
+
+# Delay before reconnecting after a failed call, doubling after each consecutive failure
+RECONNECT_BACKOFF_MIN = 1
+RECONNECT_BACKOFF_MAX = 30
+
+
+class PyroProxy:
+    """Holds a persistent Pyro proxy for a remote daemon
+       The connection is opened lazily, calls are serialised across threads (with writes going ahead
+       of queued reads), and after a failure the proxy is discarded and not reopened until an
+       exponentially increasing backoff has elapsed.
+    """
+    def __init__(self, daemon):
+        self._daemon = daemon
+        self.name = daemon.name
+
+        self._lock = DeviceLock()
+        self._proxy = None
+        self._backoff = 0
+        self._reconnect_time = 0
+
+        # Incremented after each successful connection, so that callers can tell when the daemon has reconnected
+        self.connections = 0
+
+        # Results of recent calls that can be shared between callers, keyed by method name
+        self._cache_lock = threading.Lock()
+        self._cache = {}
+
+        # Connection and query latencies, shared by the devices that use this proxy
+        self.stats = PerformanceStats()
+
+    def call(self, method, *args, timeout=5, write=False):
+        """Calls a method on the remote daemon, raising an exception on failure
+           Set write for calls that change state so that they skip ahead of any waiting queries
+        """
+        with self._lock.access(write):
+            if self._proxy is None:
+                if time.monotonic() < self._reconnect_time:
+                    raise ConnectionError(f'Waiting {self._reconnect_time - time.monotonic():.1f}s '
+                                          f'before reconnecting to {self.name}')
+                start = time.perf_counter()
+                try:
+                    self._proxy = self._daemon.connect(timeout=timeout)
+                except Exception as exception:
+                    self.stats.record('connect', time.perf_counter() - start, outcome_for(exception))
+                    raise
+                self.stats.record('connect', time.perf_counter() - start)
+                self.connections += 1
+
+            try:
+                self._proxy._pyroTimeout = timeout
+                result = getattr(self._proxy, method)(*args)
+            except Exception:
+                self.__disconnect()
+                raise
+
+            self._backoff = 0
+            return result
+
+    def __disconnect(self):
+        try:
+            self._proxy._pyroRelease()
+        except Exception:
+            pass
+
+        self._proxy = None
+        self._backoff = min(max(2 * self._backoff, RECONNECT_BACKOFF_MIN), RECONNECT_BACKOFF_MAX)
+        self._reconnect_time = time.monotonic() + self._backoff
+
+    def cached_call(self, method, max_age, timeout=5):
+        """Calls a method that takes no arguments, reusing the result of a previous call made within
+           max_age seconds so that several parameters read from the same daemon share a single query
+        """
+        with self._cache_lock:
+            cached = self._cache.get(method)
+            if cached is not None and time.monotonic() - cached[1] <= max_age:
+                return cached[0]
+
+            # Holding the lock while querying makes concurrent callers wait for (and share) this result
+            result = self.call(method, timeout=timeout)
+            self._cache[method] = (result, time.monotonic())
+            return result
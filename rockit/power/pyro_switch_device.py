@@ -16,27 +16,59 @@
 
 """Wrapper for accessing a relay device (Domealert/PowerRelay) via Pyro"""
 
+import threading
+import time
 from rockit.common import log
+from .circuit_breaker import CircuitBreaker
 from .constants import Parameter, SwitchableParameter, SwitchStatus
+from .stats import outcome_for
 
 
 class PyroSwitchParameter(Parameter, SwitchableParameter):
     """Data structure encapsulating the relay"""
+    history_dtype = 'u1'
+
     def __init__(self, name):
         Parameter.__init__(self, name, SwitchStatus.Unknown)
 
 
 class PyroSwitchDevice:
     """Wrapper for querying a switchable relay via Pyro"""
-    def __init__(self, log_name, daemon, parameter_name, query_timeout):
+    def __init__(self, log_name, proxy, parameter_name, query_timeout):
         self._log_name = log_name
         self._parameter_name = parameter_name
-        self._daemon = daemon
+        self.proxy = proxy
+        self.name = proxy.name
         self._query_timeout = query_timeout
         self._last_command_failed = False
+        self._state_lock = threading.Lock()
         self.parameters = [PyroSwitchParameter(parameter_name)]
         self.parameters_by_name = {p.name: p for p in self.parameters}
 
+        # Queries fail fast without contacting the daemon while the breaker is open
+        self.breaker = CircuitBreaker()
+
+        # Devices that share a daemon connection also share its statistics
+        self.stats = proxy.stats
+
+    def __record_success(self):
+        self.breaker.record_success()
+        with self._state_lock:
+            restored = self._last_command_failed
+            self._last_command_failed = False
+
+        if restored:
+            log.info(self._log_name, 'Restored contact with ' + self.name)
+
+    def __record_failure(self):
+        self.breaker.record_failure()
+        with self._state_lock:
+            lost = not self._last_command_failed
+            self._last_command_failed = True
+
+        if lost:
+            log.error(self._log_name, 'Lost contact with ' + self.name)
+
     def status(self):
         """Return a dictionary of parameter values for this device"""
         return {self._parameter_name: self.get_parameter(self._parameter_name)}
@@ -46,21 +78,18 @@ class PyroSwitchDevice:
         if parameter_name != self._parameter_name:
             return False
 
-        try:
-            with self._daemon.connect(timeout=self._query_timeout) as daemon:
-                enabled = daemon.get_relay()
-
-            if self._last_command_failed:
-                log.info(self._log_name, 'Restored contact with ' + self._daemon.name)
-                self._last_command_failed = False
+        if not self.breaker.allow_request():
+            return SwitchStatus.Unknown
 
+        start = time.perf_counter()
+        try:
+            enabled = self.proxy.call('get_relay', timeout=self._query_timeout)
+            self.stats.record('get_relay', time.perf_counter() - start)
+            self.__record_success()
             return SwitchStatus.On if enabled else SwitchStatus.Off
-
-        except Exception:
-            if not self._last_command_failed:
-                log.error(self._log_name, 'Lost contact with ' + self._daemon.name)
-                self._last_command_failed = True
-
+        except Exception as exception:
+            self.stats.record('get_relay', time.perf_counter() - start, outcome_for(exception))
+            self.__record_failure()
             return SwitchStatus.Unknown
 
     def set_parameter(self, parameter_name, value):
@@ -68,18 +97,20 @@ class PyroSwitchDevice:
         if parameter_name != self._parameter_name:
             return False
 
-        try:
-            with self._daemon.connect(timeout=self._query_timeout) as daemon:
-                success = daemon.set_relay(value)
-
-            if self._last_command_failed:
-                log.info(self._log_name, 'Restored contact with ' + self._daemon.name)
-                self._last_command_failed = False
+        if not self.breaker.allow_request():
+            return False
 
+        start = time.perf_counter()
+        try:
+            success = self.proxy.call('set_relay', value, timeout=self._query_timeout, write=True)
+            self.stats.record('set_relay', time.perf_counter() - start)
+            self.__record_success()
             return success
-        except Exception:
-            if not self._last_command_failed:
-                log.error(self._log_name, 'Lost contact with ' + self._daemon.name)
-                self._last_command_failed = True
-
+        except Exception as exception:
+            self.stats.record('set_relay', time.perf_counter() - start, outcome_for(exception))
+            self.__record_failure()
             return False
+
+    def set_parameters(self, values):
+        """Sets several named parameters. Returns a dictionary of success flags keyed by parameter name"""
+        return {name: self.set_parameter(name, value) for name, value in values.items()}
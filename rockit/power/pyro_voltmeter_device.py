@@ -16,8 +16,15 @@
 
 """Wrapper for querying a battery voltage over pyro"""
 
+import threading
+import time
 from rockit.common import log
+from .circuit_breaker import CircuitBreaker
 from .constants import Parameter
+from .stats import outcome_for
+
+# Voltmeters that read from the same daemon share status queries made within this many seconds
+STATUS_SHARE_WINDOW = 1
 
 
 class VoltageParameter(Parameter):
@@ -28,15 +35,41 @@ class VoltageParameter(Parameter):
 
 class PyroVoltmeterDevice:
     """Wrapper for querying a battery voltage over pyro"""
-    def __init__(self, log_name, daemon, parameter_name, query_timeout):
+    def __init__(self, log_name, proxy, parameter_name, query_timeout):
         self._log_name = log_name
         self._parameter_name = parameter_name
-        self._daemon = daemon
+        self.proxy = proxy
+        self.name = proxy.name
         self._query_timeout = query_timeout
         self._last_command_failed = False
+        self._state_lock = threading.Lock()
         self.parameters = [VoltageParameter(parameter_name)]
         self.parameters_by_name = {p.name: p for p in self.parameters}
 
+        # Queries fail fast without contacting the daemon while the breaker is open
+        self.breaker = CircuitBreaker()
+
+        # Devices that share a daemon connection also share its statistics
+        self.stats = proxy.stats
+
+    def __record_success(self):
+        self.breaker.record_success()
+        with self._state_lock:
+            restored = self._last_command_failed
+            self._last_command_failed = False
+
+        if restored:
+            log.info(self._log_name, 'Restored contact with ' + self.name)
+
+    def __record_failure(self):
+        self.breaker.record_failure()
+        with self._state_lock:
+            lost = not self._last_command_failed
+            self._last_command_failed = True
+
+        if lost:
+            log.error(self._log_name, 'Lost contact with ' + self.name)
+
     def status(self):
         """Return a dictionary of parameter values for this device"""
         return {self._parameter_name: self.get_parameter(self._parameter_name)}
@@ -46,24 +79,27 @@ class PyroVoltmeterDevice:
         if parameter_name != self._parameter_name:
             return False
 
-        try:
-            with self._daemon.connect(timeout=self._query_timeout) as daemon:
-                value = daemon.status()[parameter_name]
-
-            if self._last_command_failed:
-                log.info(self._log_name, 'Restored contact with ' + self._daemon.name)
-                self._last_command_failed = False
+        if not self.breaker.allow_request():
+            return None
 
+        start = time.perf_counter()
+        try:
+            status = self.proxy.cached_call('status', STATUS_SHARE_WINDOW, timeout=self._query_timeout)
+            value = status[parameter_name]
+            self.stats.record('status', time.perf_counter() - start)
+            self.__record_success()
             return value
-
-        except Exception:
-            if not self._last_command_failed:
-                log.error(self._log_name, 'Lost contact with ' + self._daemon.name)
-                self._last_command_failed = True
-
+        except Exception as exception:
+            self.stats.record('status', time.perf_counter() - start, outcome_for(exception))
+            self.__record_failure()
             return None
 
     def set_parameter(self, *_):
         """Sets the value of a named parameter"""
         # Voltage is read-only
         return False
+
+    def set_parameters(self, values):
+        """Sets several named parameters"""
+        # Voltage is read-only
+        return {name: False for name in values}
@@ -0,0 +1,340 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Minimal SNMP v1/v2c message encoding and decoding"""
+
+import random
+
+# BER / SNMP type tags
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_NULL = 0x05
+TAG_OBJECT_IDENTIFIER = 0x06
+TAG_SEQUENCE = 0x30
+TAG_IP_ADDRESS = 0x40
+TAG_COUNTER32 = 0x41
+TAG_GAUGE32 = 0x42
+TAG_TIMETICKS = 0x43
+TAG_COUNTER64 = 0x46
+TAG_NO_SUCH_OBJECT = 0x80
+TAG_NO_SUCH_INSTANCE = 0x81
+TAG_END_OF_MIB_VIEW = 0x82
+
+# PDU types
+PDU_GET = 0xA0
+PDU_GET_NEXT = 0xA1
+PDU_RESPONSE = 0xA2
+PDU_SET = 0xA3
+PDU_GET_BULK = 0xA5
+
+# Message versions
+VERSION_1 = 0
+VERSION_2C = 1
+
+ERROR_STATUS_LABELS = {
+    1: 'tooBig',
+    2: 'noSuchName',
+    3: 'badValue',
+    4: 'readOnly',
+    5: 'genErr',
+    6: 'noAccess',
+    7: 'wrongType',
+    8: 'wrongLength',
+    9: 'wrongEncoding',
+    10: 'wrongValue',
+    11: 'noCreation',
+    12: 'inconsistentValue',
+    13: 'resourceUnavailable',
+    14: 'commitFailed',
+    15: 'undoFailed',
+    16: 'authorizationError',
+    17: 'notWritable',
+    18: 'inconsistentName',
+}
+
+
+class SNMPError(Exception):
+    """Raised when an agent returns an error status or an invalid response"""
+
+
+class SNMPTimeout(SNMPError):
+    """Raised when an agent fails to respond to any retransmission of a request"""
+
+
+class Integer(int):
+    """SNMP INTEGER value"""
+    tag = TAG_INTEGER
+
+
+class Counter32(int):
+    """SNMP Counter32 value"""
+    tag = TAG_COUNTER32
+
+
+class Gauge32(int):
+    """SNMP Gauge32 value"""
+    tag = TAG_GAUGE32
+
+
+class TimeTicks(int):
+    """SNMP TimeTicks value"""
+    tag = TAG_TIMETICKS
+
+
+class Counter64(int):
+    """SNMP Counter64 value"""
+    tag = TAG_COUNTER64
+
+
+class OctetString(bytes):
+    """SNMP OCTET STRING value"""
+    tag = TAG_OCTET_STRING
+
+
+class IpAddress(bytes):
+    """SNMP IpAddress value"""
+    tag = TAG_IP_ADDRESS
+
+
+class ObjectIdentifier(str):
+    """SNMP OBJECT IDENTIFIER value, in dotted form with a leading '.'"""
+    tag = TAG_OBJECT_IDENTIFIER
+
+
+class Null:
+    """SNMP NULL value and the v2c exception values that share its empty encoding"""
+    def __init__(self, tag=TAG_NULL):
+        self.tag = tag
+
+    def __eq__(self, other):
+        return isinstance(other, Null) and other.tag == self.tag
+
+    def __hash__(self):
+        return hash(self.tag)
+
+    def __repr__(self):
+        return {
+            TAG_NO_SUCH_OBJECT: 'noSuchObject',
+            TAG_NO_SUCH_INSTANCE: 'noSuchInstance',
+            TAG_END_OF_MIB_VIEW: 'endOfMibView'
+        }.get(self.tag, 'NULL')
+
+
+NO_SUCH_OBJECT = Null(TAG_NO_SUCH_OBJECT)
+NO_SUCH_INSTANCE = Null(TAG_NO_SUCH_INSTANCE)
+END_OF_MIB_VIEW = Null(TAG_END_OF_MIB_VIEW)
+
+_INTEGER_TYPES = {
+    TAG_INTEGER: Integer,
+    TAG_COUNTER32: Counter32,
+    TAG_GAUGE32: Gauge32,
+    TAG_TIMETICKS: TimeTicks,
+    TAG_COUNTER64: Counter64,
+}
+
+
+def _encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(encoded)]) + encoded
+
+
+def _encode_tlv(tag, content):
+    return bytes([tag]) + _encode_length(len(content)) + content
+
+
+def _encode_integer(tag, value):
+    # Minimal two's complement encoding; unsigned application types gain a leading zero byte if needed
+    length = ((value if value >= 0 else ~value).bit_length() + 8) // 8
+    return _encode_tlv(tag, value.to_bytes(length, 'big', signed=True))
+
+
+def _encode_oid(oid):
+    parts = [int(p) for p in oid.strip('.').split('.')]
+    if len(parts) < 2:
+        raise SNMPError('Invalid OID: ' + oid)
+
+    content = bytearray([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7F]
+        part >>= 7
+        while part:
+            chunk.append(0x80 | (part & 0x7F))
+            part >>= 7
+        content.extend(reversed(chunk))
+    return _encode_tlv(TAG_OBJECT_IDENTIFIER, bytes(content))
+
+
+def encode_value(value):
+    """Encodes a python value as a BER TLV. Plain ints are sent as INTEGER and None as NULL"""
+    if value is None:
+        return _encode_tlv(TAG_NULL, b'')
+    if isinstance(value, Null):
+        return _encode_tlv(value.tag, b'')
+    if isinstance(value, ObjectIdentifier):
+        return _encode_oid(value)
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return _encode_integer(getattr(value, 'tag', TAG_INTEGER), int(value))
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if isinstance(value, bytes):
+        return _encode_tlv(getattr(value, 'tag', TAG_OCTET_STRING), bytes(value))
+    raise SNMPError(f'Unable to encode SNMP value {value!r}')
+
+
+def _decode_tlv(data, offset):
+    """Returns the (tag, content start, content end) of the TLV at offset"""
+    if offset + 2 > len(data):
+        raise SNMPError('Truncated SNMP message')
+
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7F
+        if count == 0 or offset + count > len(data):
+            raise SNMPError('Invalid BER length')
+        length = int.from_bytes(data[offset:offset + count], 'big')
+        offset += count
+
+    if offset + length > len(data):
+        raise SNMPError('Truncated SNMP message')
+
+    return tag, offset, offset + length
+
+
+def _decode_oid(content):
+    subidentifiers = []
+    value = 0
+    for byte in content:
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            subidentifiers.append(value)
+            value = 0
+
+    if not subidentifiers:
+        raise SNMPError('Empty OID')
+
+    # The first subidentifier packs the first two arcs as 40 * X + Y
+    first = min(subidentifiers[0] // 40, 2)
+    parts = [first, subidentifiers[0] - 40 * first] + subidentifiers[1:]
+    return '.' + '.'.join(str(p) for p in parts)
+
+
+def _decode_value(tag, content):
+    if tag in _INTEGER_TYPES:
+        return _INTEGER_TYPES[tag](int.from_bytes(content, 'big', signed=tag == TAG_INTEGER))
+    if tag == TAG_OCTET_STRING:
+        return OctetString(content)
+    if tag == TAG_IP_ADDRESS:
+        return IpAddress(content)
+    if tag == TAG_OBJECT_IDENTIFIER:
+        return ObjectIdentifier(_decode_oid(content))
+    if tag in (TAG_NULL, TAG_NO_SUCH_OBJECT, TAG_NO_SUCH_INSTANCE, TAG_END_OF_MIB_VIEW):
+        return Null(tag)
+    raise SNMPError(f'Unsupported SNMP value type 0x{tag:02x}')
+
+
+def decode_value(data):
+    """Decodes a single BER TLV produced by encode_value"""
+    tag, start, end = _decode_tlv(data, 0)
+    return _decode_value(tag, data[start:end])
+
+
+def _expect(data, offset, tag):
+    actual, start, end = _decode_tlv(data, offset)
+    if actual != tag:
+        raise SNMPError(f'Expected BER tag 0x{tag:02x}, found 0x{actual:02x}')
+    return start, end
+
+
+def encode_message(version, community, pdu_type, request_id, varbinds, error_status=0, error_index=0):
+    """Encodes an SNMP message. varbinds is a list of (oid, value) tuples.
+       GetBulk requests carry non-repeaters and max-repetitions in the error_status and error_index fields.
+    """
+    encoded_varbinds = b''.join(
+        _encode_tlv(TAG_SEQUENCE, _encode_oid(oid) + encode_value(value)) for oid, value in varbinds)
+
+    pdu = _encode_integer(TAG_INTEGER, request_id) + \
+        _encode_integer(TAG_INTEGER, error_status) + \
+        _encode_integer(TAG_INTEGER, error_index) + \
+        _encode_tlv(TAG_SEQUENCE, encoded_varbinds)
+
+    if isinstance(community, str):
+        community = community.encode('utf-8')
+
+    return _encode_tlv(TAG_SEQUENCE, _encode_integer(TAG_INTEGER, version) +
+                       _encode_tlv(TAG_OCTET_STRING, community) +
+                       _encode_tlv(pdu_type, pdu))
+
+
+def decode_message(data):
+    """Decodes an SNMP message into a dictionary with version, community, pdu_type,
+       request_id, error_status, error_index, and varbinds (list of (oid, value) tuples)
+    """
+    start, _ = _expect(data, 0, TAG_SEQUENCE)
+    version_start, version_end = _expect(data, start, TAG_INTEGER)
+    community_start, community_end = _expect(data, version_end, TAG_OCTET_STRING)
+    pdu_type, offset, _ = _decode_tlv(data, community_end)
+
+    fields = []
+    for _ in range(3):
+        field_start, offset = _expect(data, offset, TAG_INTEGER)
+        fields.append(int.from_bytes(data[field_start:offset], 'big', signed=True))
+
+    offset, varbinds_end = _expect(data, offset, TAG_SEQUENCE)
+    varbinds = []
+    while offset < varbinds_end:
+        varbind_start, varbind_end = _expect(data, offset, TAG_SEQUENCE)
+        oid_start, oid_end = _expect(data, varbind_start, TAG_OBJECT_IDENTIFIER)
+        tag, value_start, value_end = _decode_tlv(data, oid_end)
+        varbinds.append((_decode_oid(data[oid_start:oid_end]), _decode_value(tag, bytes(data[value_start:value_end]))))
+        offset = varbind_end
+
+    return {
+        'version': int.from_bytes(data[version_start:version_end], 'big'),
+        'community': bytes(data[community_start:community_end]),
+        'pdu_type': pdu_type,
+        'request_id': fields[0],
+        'error_status': fields[1],
+        'error_index': fields[2],
+        'varbinds': varbinds
+    }
+
+
+def check_response(response, oids, exact_count=True):
+    """Raises SNMPError if a decoded response reports an error; otherwise returns its (oid, value) varbinds"""
+    if response['pdu_type'] != PDU_RESPONSE:
+        raise SNMPError(f'Unexpected PDU type 0x{response["pdu_type"]:02x}')
+
+    if response['error_status'] != 0:
+        label = ERROR_STATUS_LABELS.get(response['error_status'], str(response['error_status']))
+        index = response['error_index']
+        oid = oids[index - 1] if 0 < index <= len(oids) else None
+        raise SNMPError(f'Agent returned {label}' + (f' for {oid}' if oid else ''))
+
+    if exact_count and len(response['varbinds']) != len(oids):
+        raise SNMPError(f'Expected {len(oids)} values, received {len(response["varbinds"])}')
+
+    return response['varbinds']
+
+
+def new_request_id():
+    """Returns a random request id that fits in a positive 32 bit INTEGER"""
+    return random.randint(1, 0x7FFFFFFF)
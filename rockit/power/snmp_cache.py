@@ -0,0 +1,111 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""SNMP get responses shared between power daemons that poll the same hardware"""
+
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from .snmp import decode_value, encode_value
+
+DEFAULT_CACHE_PATH = '/dev/shm/rockit-power-snmp'
+
+
+class SNMPResponseCache:
+    """Shares the values returned by SNMP get requests between processes on the same host
+       Each agent (ip and port) has a json file in path (normally on a tmpfs) that holds the encoded value
+       and receive time of each OID, keyed by the community and OID. Any set request to the agent discards
+       these values so that the next read queries the device.
+       The methods block on file I/O and locks, so SNMPClient calls them from the event loop's executor.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_age=1):
+        self._path = path
+        self._max_age = max_age
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def __agent_path(self, ip, port):
+        return os.path.join(self._path, f'{ip}_{port}.json')
+
+    @staticmethod
+    def __key(community, oid):
+        # Communities act as passwords, so are not stored in plain text
+        if isinstance(community, str):
+            community = community.encode('utf-8')
+        return hashlib.sha1(community).hexdigest()[:16] + ' ' + oid
+
+    @staticmethod
+    def __read(path):
+        """Returns the time of the last set request and the dictionary of cached values"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data['invalidated'], data['values']
+        except (OSError, ValueError, KeyError):
+            return 0, {}
+
+    def __write(self, path, invalidated, entries):
+        with tempfile.NamedTemporaryFile('w', dir=self._path, delete=False, encoding='utf-8') as f:
+            json.dump({'invalidated': invalidated, 'values': entries}, f)
+        os.replace(f.name, path)
+
+    def get(self, ip, port, community, oids):
+        """Returns a list of cached values for the given OIDs, or None if any are missing or too old"""
+        _, entries = self.__read(self.__agent_path(ip, port))
+        now = time.time()
+        values = []
+        for oid in oids:
+            entry = entries.get(self.__key(community, oid))
+            if entry is None or now - entry[0] > self._max_age:
+                return None
+            values.append(decode_value(bytes.fromhex(entry[1])))
+        return values
+
+    def store(self, ip, port, community, oids, values, request_time):
+        """Records the values returned by a get request that was sent at request_time (unix timestamp)"""
+        path = self.__agent_path(ip, port)
+        try:
+            # Hold a lock while merging so that concurrent writers don't discard each other's values
+            with open(path + '.lock', 'w', encoding='utf-8') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                invalidated, entries = self.__read(path)
+
+                # The values may predate a set request made by another process while this request was in flight
+                if invalidated >= request_time:
+                    return
+
+                # Drop entries that are no longer fresh so the file can't grow without limit
+                now = time.time()
+                entries = {k: v for k, v in entries.items() if now - v[0] <= self._max_age}
+                for oid, value in zip(oids, values):
+                    entries[self.__key(community, oid)] = [request_time, encode_value(value).hex()]
+
+                self.__write(path, invalidated, entries)
+        except OSError as exception:
+            print(f'{datetime.datetime.utcnow()} ERROR: failed to update SNMP cache {path}: {exception}')
+
+    def invalidate(self, ip, port):
+        """Discards all cached values for an agent. Called after every set request"""
+        path = self.__agent_path(ip, port)
+        try:
+            with open(path + '.lock', 'w', encoding='utf-8') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self.__write(path, time.time(), {})
+        except OSError as exception:
+            print(f'{datetime.datetime.utcnow()} ERROR: failed to invalidate SNMP cache {path}: {exception}')
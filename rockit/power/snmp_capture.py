@@ -0,0 +1,185 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Recording and offline replay of SNMP traffic"""
+
+import asyncio
+from collections import deque
+import datetime
+import json
+import queue
+import struct
+import threading
+import time
+from .snmp import check_response, decode_message, PDU_GET_BULK, PDU_SET, SNMPTimeout
+from .snmp_transport import SNMPTransport
+
+# A capture file starts with the magic bytes and a length-prefixed json header holding the device config.
+# Each request is then stored as a record header (unix time, latency in seconds, request length,
+# response length) followed by the raw request and response messages. Requests that timed out
+# have a zero length response.
+CAPTURE_MAGIC = b'SNMPCAP1'
+HEADER_LENGTH = struct.Struct('<I')
+RECORD = struct.Struct('<dfHH')
+
+
+class SNMPCapture:
+    """Appends every request/response pair sent by a SNMPDevice to a capture file
+       Records are written by a background thread so that the transport loop never waits on the disk.
+       Call close (or use as a context manager) to write the queued records and close the file
+    """
+    def __init__(self, path, device_config):
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')  # pylint: disable=consider-using-with
+        try:
+            if self._file.tell() == 0:
+                header = json.dumps({'device': device_config, 'created': time.time()}).encode('utf-8')
+                self._file.write(CAPTURE_MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+                self._file.flush()
+        except Exception:
+            self._file.close()
+            raise
+
+        self._thread = threading.Thread(target=self.__write_records, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, request, response, latency):
+        """Queues a raw request message and the raw response (or None if the request timed out) to be written"""
+        response = response or b''
+        with self._lock:
+            if not self._closed:
+                self._queue.put(RECORD.pack(time.time(), latency, len(request), len(response)) + request + response)
+
+    def close(self):
+        """Writes any queued records and closes the capture file. Later records are discarded"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def __write_records(self):
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    return
+
+                try:
+                    self._file.write(data)
+                    self._file.flush()
+                except OSError as exception:
+                    print(f'{datetime.datetime.utcnow()} ERROR: failed to write SNMP capture: {exception}')
+        finally:
+            self._file.close()
+
+
+def _parse_header(path, data):
+    """Returns the header dictionary and the offset of the first record"""
+    if data[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+        raise ValueError(f'{path} is not a SNMP capture file')
+
+    offset = len(CAPTURE_MAGIC)
+    header_length, = HEADER_LENGTH.unpack_from(data, offset)
+    offset += HEADER_LENGTH.size
+    return json.loads(bytes(data[offset:offset + header_length]).decode('utf-8')), offset + header_length
+
+
+def read_capture_header(path):
+    """Returns the header dictionary from a capture file without reading the records"""
+    with open(path, 'rb') as f:
+        data = f.read(len(CAPTURE_MAGIC) + HEADER_LENGTH.size)
+        if len(data) == len(CAPTURE_MAGIC) + HEADER_LENGTH.size:
+            data += f.read(HEADER_LENGTH.unpack_from(data, len(CAPTURE_MAGIC))[0])
+    return _parse_header(path, data)[0]
+
+
+def read_capture(path):
+    """Returns the header dictionary and a list of (time, latency, request, response) tuples from a capture file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    header, offset = _parse_header(path, data)
+
+    records = []
+    while offset + RECORD.size <= len(data):
+        timestamp, latency, request_length, response_length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+
+        # Ignore a partially written record at the end of the file
+        if offset + request_length + response_length > len(data):
+            break
+
+        request = data[offset:offset + request_length]
+        offset += request_length
+        response = data[offset:offset + response_length] if response_length else None
+        offset += response_length
+        records.append((timestamp, latency, request, response))
+
+    return header, records
+
+
+def _request_key(pdu_type, community, varbinds, max_repetitions):
+    """Identifies equivalent requests regardless of their request-id. Only set requests compare values"""
+    if isinstance(community, str):
+        community = community.encode('utf-8')
+    values = tuple((oid, repr(value) if pdu_type == PDU_SET else None) for oid, value in varbinds)
+    return pdu_type, community, max_repetitions, values
+
+
+class SNMPReplayTransport(SNMPTransport):
+    """Answers SNMPClient requests from a capture file instead of the network
+       Each request is matched to the recorded responses for the same PDU type, community, and varbinds,
+       which are returned in order (repeating once exhausted) after the recorded latency divided by speed.
+       A speed of 0 returns responses immediately.
+    """
+    def __init__(self, path, speed=1):
+        SNMPTransport.__init__(self)
+        self.header, records = read_capture(path)
+        self._speed = speed
+        self._responses = {}
+        for _, latency, request, response in records:
+            message = decode_message(request)
+            key = _request_key(message['pdu_type'], message['community'], message['varbinds'],
+                               message['error_index'] if message['pdu_type'] == PDU_GET_BULK else 0)
+            self._responses.setdefault(key, deque()).append((latency, response))
+
+    async def request(self, ip, port, community, version, pdu_type, varbinds, timeout, retries, max_repetitions=0,
+                      capture=None):
+        """Returns the next recorded response to an equivalent request"""
+        key = _request_key(pdu_type, community, varbinds, max_repetitions)
+        recorded = self._responses.get(key)
+        if not recorded:
+            raise SNMPTimeout(f'No recorded response from {ip} for this request')
+
+        latency, response = recorded[0]
+        recorded.rotate(-1)
+        if self._speed:
+            await asyncio.sleep(min(latency, timeout) / self._speed)
+
+        if response is None:
+            raise SNMPTimeout(f'No response from {ip} after {timeout} seconds')
+
+        return check_response(decode_message(response), [oid for oid, _ in varbinds], pdu_type != PDU_GET_BULK)
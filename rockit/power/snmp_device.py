@@ -16,98 +16,218 @@
 
 """Wrapper for accessing a device via SNMP"""
 
+import asyncio
 import datetime
-import subprocess
+import time
 from rockit.common import log
+from .circuit_breaker import CircuitBreaker
 from .constants import Parameter
+from .device_lock import AsyncDeviceLock
+from .snmp import Integer, VERSION_1, VERSION_2C
+from .snmp_transport import SNMPClient
+from .stats import Outcome, PerformanceStats, outcome_for
 
 
 class SNMPParameter(Parameter):
-    """Data structure encapsulating a parameter fetched/set via SNMP"""
-    def __init__(self, name, get_oid, set_oid, error_value):
+    """Data structure encapsulating a parameter fetched/set via SNMP
+       Parameters that are a row of a table also define the table column OID and the row index,
+       which allows devices to fetch the whole column with a bulk walk.
+    """
+    def __init__(self, name, get_oid, set_oid, error_value, column_oid=None, row_index=None):
         Parameter.__init__(self, name, error_value)
         self.get_oid = get_oid
         self.set_oid = set_oid
+        self.column_oid = column_oid
+        self.row_index = row_index
 
 
 class IntegerSNMPParameter(Parameter):
     """Data structure encapsulating a parameter fetched/set via SNMP"""
-    def __init__(self, name, get_oid, set_oid, error_value):
+    history_dtype = 'i4'
+
+    def __init__(self, name, get_oid, set_oid, error_value, column_oid=None, row_index=None):
         Parameter.__init__(self, name, error_value)
         self.get_oid = get_oid
         self.set_oid = set_oid
+        self.column_oid = column_oid
+        self.row_index = row_index
 
-    def parse_snmpget_output(self, output):
-        """Convert a snmpget output string for this parameter into a python value"""
-        parts = output.split(' ')
+    def parse_get_value(self, value):
+        """Convert a value returned by a SNMP get for this parameter into a python value"""
+        if not isinstance(value, Integer):
+            raise Exception(f'Unable to parse integer from SNMP value: {value!r}')
 
-        if parts[-2] != 'INTEGER:':
-            raise Exception('Unabled to parse integer from SNMP output: ' + output)
+        return int(value)
 
-        return int(parts[-1])
-
-    def parse_snmpset_output(self, output):
-        """Convert a snmpset output string for this parameter into a python value"""
-        return self.parse_snmpget_output(output)
+    def parse_set_value(self, value):
+        """Convert a value returned by a SNMP set for this parameter into a python value"""
+        return self.parse_get_value(value)
 
 
 class SNMPDevice:
-    """Wrapper for querying an APC PDU or UPS via SNMP"""
-    def __init__(self, log_name, ip, parameters, query_timeout, get_community='public', set_community='private'):
+    """Wrapper for querying an APC PDU or UPS via SNMP
+       Set bulk_walk to fetch table parameters (PDU outlets, PoE ports) using SNMP v2c GetBulk
+       column walks instead of listing every row in a single large get request.
+       Set capture to a SNMPCapture to record all traffic to and from the device.
+       Set cache to a SNMPResponseCache to share get responses with other daemons that poll the same device.
+       All queries run on the transport loop and are serialised per device, with sets taking priority
+       over queued reads.
+    """
+    def __init__(self, log_name, transport, ip, parameters, query_timeout, get_community='public',
+                 set_community='private', retries=1, bulk_walk=False, port=161, capture=None, cache=None):
         self._log_name = log_name
-        self._ip = ip
-        self._query_timeout = query_timeout
+        self.name = ip if port == 161 else f'{ip}:{port}'
         self._last_command_failed = False
-        self._get_community = get_community
-        self._set_community = set_community
+        self._transport = transport
+        self._bulk_walk = bulk_walk
+        self._capture = capture
+        version = VERSION_2C if bulk_walk else VERSION_1
+        self._get_client = SNMPClient(transport, ip, get_community, query_timeout, retries, version, port, capture,
+                                      cache)
+        self._set_client = SNMPClient(transport, ip, set_community, query_timeout, retries, version, port, capture,
+                                      cache)
         self.parameters = parameters
         self.parameters_by_name = {p.name: p for p in parameters}
 
+        # Queries fail fast without contacting the device while the breaker is open
+        self.breaker = CircuitBreaker()
+
+        # Management cards only handle a few requests at once, so only one query is sent at a time
+        self._lock = AsyncDeviceLock()
+
+        # Latency and error counters for each type of query
+        self.stats = PerformanceStats()
+
+    def close(self):
+        """Closes the capture file (if any) once the device is no longer used"""
+        if self._capture is not None:
+            self._capture.close()
+
+    def __record_success(self):
+        self.breaker.record_success()
+        if self._last_command_failed:
+            log.info(self._log_name, 'Restored contact with ' + self.name)
+            self._last_command_failed = False
+
+    def __record_failure(self):
+        self.breaker.record_failure()
+        if not self._last_command_failed:
+            log.error(self._log_name, 'Lost contact with ' + self.name)
+            self._last_command_failed = True
+
     def status(self):
         """Return a dictionary of parameter values for this device"""
-        # Query all OIDs at once for efficiency
-        oids = [p.get_oid for p in self.parameters]
-        args = ['/usr/bin/snmpget', '-v', '1', '-c', self._get_community, self._ip] + oids
-        try:
-            output = subprocess.check_output(args, universal_newlines=True,
-                                             timeout=self._query_timeout)
-            lines = output.strip().split('\n')
+        return self._transport.run(self.status_async())
 
-            if self._last_command_failed:
-                log.info(self._log_name, 'Restored contact with ' + self._ip)
-                self._last_command_failed = False
+    def status_future(self):
+        """Start querying the device on the shared SNMP transport without blocking a thread.
+           Returns a concurrent.futures.Future for the status dictionary.
+        """
+        return self._transport.submit(self.status_async())
+
+    async def status_async(self):
+        """Return a dictionary of parameter values for this device"""
+        if not self.breaker.allow_request():
+            return {k.name: k.error_value for k in self.parameters}
 
-            # Return a dictionary of values keyed by parameter name
-            return {k.name: k.parse_snmpget_output(v) for k, v in zip(self.parameters, lines)}
+        start = time.perf_counter()
+        try:
+            async with self._lock.access():
+                if self._bulk_walk:
+                    values = await self.__walk_parameters()
+                else:
+                    # Query all OIDs at once for efficiency
+                    values = await self._get_client.get_async([p.get_oid for p in self.parameters])
         except Exception as exception:
-            print(f'{datetime.datetime.utcnow()} ERROR: failed to query {self._ip}: {exception}')
+            self.stats.record('status', time.perf_counter() - start, outcome_for(exception))
+            print(f'{datetime.datetime.utcnow()} ERROR: failed to query {self.name}: {exception}')
 
-            if not self._last_command_failed:
-                log.error(self._log_name, 'Lost contact with ' + self._ip)
-                self._last_command_failed = True
+            self.__record_failure()
 
             return {k.name: k.error_value for k in self.parameters}
 
+        # Return a dictionary of values keyed by parameter name
+        try:
+            ret = {k.name: k.parse_get_value(v) if v is not None else k.error_value
+                   for k, v in zip(self.parameters, values)}
+            self.stats.record('status', time.perf_counter() - start)
+        except Exception as exception:
+            ret = {k.name: k.error_value for k in self.parameters}
+            self.stats.record('status', time.perf_counter() - start, Outcome.ParseError)
+            print(f'{datetime.datetime.utcnow()} ERROR: failed to parse SNMP response from {self.name}: {exception}')
+
+        # The device has responded, so an invalid response doesn't count towards opening the breaker
+        self.__record_success()
+        return ret
+
+    async def __walk_parameters(self):
+        """Fetch each table column with a bulk walk and the remaining scalar parameters with a single get
+           Returns a list of raw values matching self.parameters, with None for rows missing from the table
+        """
+        columns = list({p.column_oid for p in self.parameters if p.column_oid})
+        scalars = [p for p in self.parameters if not p.column_oid]
+
+        requests = [self._get_client.walk_async(c) for c in columns]
+        if scalars:
+            requests.append(self._get_client.get_async([p.get_oid for p in scalars]))
+
+        results = await asyncio.gather(*requests)
+        rows = dict(zip(columns, results))
+        scalar_values = dict(zip(scalars, results[-1])) if scalars else {}
+
+        values = []
+        for p in self.parameters:
+            if p.column_oid:
+                value = rows[p.column_oid].get(p.row_index)
+                if value is None:
+                    print(f'{datetime.datetime.utcnow()} ERROR: {self.name} has no row {p.row_index} in {p.column_oid}')
+                values.append(value)
+            else:
+                values.append(scalar_values[p])
+        return values
+
     def get_parameter(self, parameter_name):
+        """Returns the value of a named parameter"""
+        return self._transport.run(self.get_parameter_async(parameter_name))
+
+    async def get_parameter_async(self, parameter_name):
         """Returns the value of a named parameter"""
         if parameter_name not in self.parameters_by_name:
             return False
 
         parameter = self.parameters_by_name[parameter_name]
+        if not self.breaker.allow_request():
+            return parameter.error_value
+
+        start = time.perf_counter()
         try:
-            args = ['/usr/bin/snmpget', '-v', '1', '-c', self._get_community, self._ip, parameter.get_oid]
-            output = subprocess.check_output(args, universal_newlines=True, timeout=self._query_timeout)
-            return parameter.parse_snmpget_output(output)
+            async with self._lock.access():
+                output = (await self._get_client.get_async([parameter.get_oid]))[0]
         except Exception as exception:
-            print(f'{datetime.datetime.utcnow()} ERROR: failed to query {self._ip}: {exception}')
+            self.stats.record('get', time.perf_counter() - start, outcome_for(exception))
+            print(f'{datetime.datetime.utcnow()} ERROR: failed to query {self.name}: {exception}')
 
-            if not self._last_command_failed:
-                log.error(self._log_name, 'Lost contact with ' + self._ip)
-                self._last_command_failed = True
+            self.__record_failure()
 
             return parameter.error_value
 
+        try:
+            value = parameter.parse_get_value(output)
+            self.stats.record('get', time.perf_counter() - start)
+        except Exception as exception:
+            value = parameter.error_value
+            self.stats.record('get', time.perf_counter() - start, Outcome.ParseError)
+            print(f'{datetime.datetime.utcnow()} ERROR: failed to parse SNMP response from {self.name}: {exception}')
+
+        # The device has responded, so an invalid response doesn't count towards opening the breaker
+        self.__record_success()
+        return value
+
     def set_parameter(self, parameter_name, value):
+        """Sets the value of a named parameter"""
+        return self._transport.run(self.set_parameter_async(parameter_name, value))
+
+    async def set_parameter_async(self, parameter_name, value):
         """Sets the value of a named parameter"""
         if parameter_name not in self.parameters_by_name:
             return False
@@ -118,30 +238,77 @@ class SNMPDevice:
         if not parameter.set_oid:
             return False
 
+        if not self.breaker.allow_request():
+            return False
+
+        start = time.perf_counter()
         try:
-            args = ['/usr/bin/snmpset', '-v', '1', '-c', self._set_community, self._ip, parameter.set_oid,
-                    'i', parameter.format_set_value(value)]
-
-            output = subprocess.check_output(args, universal_newlines=True,
-                                             timeout=self._query_timeout)
-            if self._last_command_failed:
-                log.info(self._log_name, 'Restored contact with ' + self._ip)
-                self._last_command_failed = False
+            async with self._lock.access(write=True):
+                output = (await self._set_client.set_async([(parameter.set_oid,
+                                                             parameter.format_set_value(value))]))[0]
+            self.__record_success()
         except Exception as exception:
+            self.stats.record('set', time.perf_counter() - start, outcome_for(exception))
             print(f'{datetime.datetime.utcnow()} ERROR: failed to send SNMP command: {exception}')
 
-            if not self._last_command_failed:
-                log.error(self._log_name, 'Lost contact with ' + self._ip)
-                self._last_command_failed = True
+            self.__record_failure()
 
             return False
 
         try:
-            return parameter.parse_snmpset_output(output) == value
+            success = parameter.parse_set_value(output) == value
+            self.stats.record('set', time.perf_counter() - start)
+            return success
         except Exception as exception:
+            self.stats.record('set', time.perf_counter() - start, Outcome.ParseError)
             print(f'{datetime.datetime.utcnow()} ERROR: failed to parse SNMP response: {exception}')
 
             if not self._last_command_failed:
-                log.error(self._log_name, f'Invalid response from {self._ip}: {exception}')
+                log.error(self._log_name, f'Invalid response from {self.name}: {exception}')
 
             return False
+
+    def set_parameters(self, values):
+        """Sets several named parameters using a single SNMP request
+           Returns a dictionary of success flags keyed by parameter name
+        """
+        return self._transport.run(self.set_parameters_async(values))
+
+    async def set_parameters_async(self, values):
+        """Sets several named parameters using a single SNMP request
+           Returns a dictionary of success flags keyed by parameter name
+        """
+        results = {name: False for name in values}
+        parameters = [self.parameters_by_name[name] for name in values
+                      if name in self.parameters_by_name and self.parameters_by_name[name].set_oid]
+
+        if not parameters or not self.breaker.allow_request():
+            return results
+
+        start = time.perf_counter()
+        try:
+            async with self._lock.access(write=True):
+                output = await self._set_client.set_async([(p.set_oid, p.format_set_value(values[p.name]))
+                                                           for p in parameters])
+            self.__record_success()
+        except Exception as exception:
+            self.stats.record('set', time.perf_counter() - start, outcome_for(exception))
+            print(f'{datetime.datetime.utcnow()} ERROR: failed to send SNMP command: {exception}')
+
+            self.__record_failure()
+
+            return results
+
+        outcome = Outcome.Success
+        for parameter, value in zip(parameters, output):
+            try:
+                results[parameter.name] = parameter.parse_set_value(value) == values[parameter.name]
+            except Exception as exception:
+                outcome = Outcome.ParseError
+                print(f'{datetime.datetime.utcnow()} ERROR: failed to parse SNMP response: {exception}')
+
+                if not self._last_command_failed:
+                    log.error(self._log_name, f'Invalid response from {self.name}: {exception}')
+
+        self.stats.record('set', time.perf_counter() - start, outcome)
+        return results
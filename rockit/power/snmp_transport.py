@@ -0,0 +1,204 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Multiplexes SNMP requests to many agents over a single UDP socket"""
+
+import asyncio
+import threading
+import time
+from .snmp import (
+    check_response, decode_message, encode_message, new_request_id,
+    END_OF_MIB_VIEW, PDU_GET, PDU_GET_BULK, PDU_SET, SNMPError, SNMPTimeout, VERSION_1)
+
+# Upper limit on the number of GetBulk requests in a single walk
+MAX_WALK_REQUESTS = 1000
+
+
+class _SNMPProtocol(asyncio.DatagramProtocol):
+    """Routes received datagrams to the pending request with the matching request-id"""
+    def __init__(self, pending):
+        self._pending = pending
+
+    def datagram_received(self, data, addr):
+        try:
+            response = decode_message(data)
+        except SNMPError:
+            return
+
+        pending = self._pending.get(response['request_id'])
+
+        # Ignore late responses to abandoned requests and responses from the wrong agent
+        if pending is not None and pending[0] == addr[:2] and not pending[1].done():
+            pending[1].set_result((response, data))
+
+
+class SNMPTransport:
+    """Owns one UDP socket and an asyncio event loop (on a background thread) used to
+       send requests to every SNMP agent. Requests are matched to responses by request-id,
+       so any number of agents can be queried concurrently in the same loop turn.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._loop = None
+        self._transport = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, daemon=True)
+            thread.start()
+
+            async def open_socket():
+                return await loop.create_datagram_endpoint(
+                    lambda: _SNMPProtocol(self._pending), local_addr=('0.0.0.0', 0))
+
+            self._transport, _ = asyncio.run_coroutine_threadsafe(open_socket(), loop).result()
+            self._loop = loop
+
+    async def request(self, ip, port, community, version, pdu_type, varbinds, timeout, retries, max_repetitions=0,
+                      capture=None):
+        """Sends a request and returns the list of (oid, value) varbinds in the response.
+           The request is resent if no response arrives within timeout / (retries + 1) seconds.
+           max_repetitions is only used by GetBulk requests, which treat every varbind as a repeater.
+           If capture is given, the raw request and response messages are passed to its record method.
+        """
+        request_id = new_request_id()
+        while request_id in self._pending:
+            request_id = new_request_id()
+
+        message = encode_message(version, community, pdu_type, request_id, varbinds, error_index=max_repetitions)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = ((ip, port), future)
+        start = time.monotonic()
+        try:
+            for _ in range(retries + 1):
+                self._transport.sendto(message, (ip, port))
+                try:
+                    response, data = await asyncio.wait_for(asyncio.shield(future), timeout / (retries + 1))
+                except asyncio.TimeoutError:
+                    continue
+
+                if capture is not None:
+                    capture.record(message, data, time.monotonic() - start)
+                return check_response(response, [oid for oid, _ in varbinds], pdu_type != PDU_GET_BULK)
+        finally:
+            self._pending.pop(request_id, None)
+
+        if capture is not None:
+            capture.record(message, None, time.monotonic() - start)
+        raise SNMPTimeout(f'No response from {ip} after {timeout} seconds')
+
+    def submit(self, coroutine):
+        """Schedules a coroutine on the transport loop and returns a concurrent.futures.Future"""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run(self, coroutine):
+        """Runs a coroutine on the transport loop and blocks until it completes"""
+        return self.submit(coroutine).result()
+
+
+class SNMPClient:
+    """Sends requests to a single SNMP agent through a shared SNMPTransport"""
+    def __init__(self, transport, ip, community, timeout, retries=1, version=VERSION_1, port=161, capture=None,
+                 cache=None):
+        self.transport = transport
+        self.capture = capture
+        self.cache = cache
+        self.ip = ip
+        self.port = port
+        self.community = community
+        self.version = version
+        self.timeout = timeout
+        self.retries = retries
+
+    async def get_async(self, oids):
+        """Returns a list of values for the given OIDs
+           If a SNMPResponseCache is set, values that were recently read by any process are returned without
+           querying the agent
+        """
+        # The cache reads files and takes file locks, so must not block the shared transport loop
+        loop = asyncio.get_running_loop()
+        if self.cache is not None:
+            values = await loop.run_in_executor(None, self.cache.get, self.ip, self.port, self.community, oids)
+            if values is not None:
+                return values
+
+        request_time = time.time()
+        response = await self.transport.request(self.ip, self.port, self.community, self.version, PDU_GET,
+                                                [(oid, None) for oid in oids], self.timeout, self.retries,
+                                                capture=self.capture)
+        values = [value for _, value in response]
+        if self.cache is not None:
+            await loop.run_in_executor(None, self.cache.store, self.ip, self.port, self.community, oids, values,
+                                       request_time)
+        return values
+
+    async def set_async(self, varbinds):
+        """Sets a list of (oid, value) tuples and returns the values reported by the agent"""
+        try:
+            response = await self.transport.request(self.ip, self.port, self.community, self.version, PDU_SET,
+                                                    varbinds, self.timeout, self.retries, capture=self.capture)
+        finally:
+            # The set may have changed any of the values read by other processes
+            if self.cache is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.cache.invalidate, self.ip, self.port)
+        return [value for _, value in response]
+
+    async def walk_async(self, column_oid, max_repetitions=32):
+        """Returns a dictionary of values keyed by the row index of every entry under column_oid.
+           Uses GetBulk (SNMP v2c) to fetch up to max_repetitions rows per request.
+        """
+        prefix = column_oid + '.'
+        rows = {}
+        oid = column_oid
+        previous = _oid_key(column_oid)
+        for _ in range(MAX_WALK_REQUESTS):
+            response = await self.transport.request(self.ip, self.port, self.community, self.version,
+                                                    PDU_GET_BULK, [(oid, None)], self.timeout, self.retries,
+                                                    max_repetitions=max_repetitions, capture=self.capture)
+            if not response:
+                return rows
+
+            for oid, value in response:
+                if not oid.startswith(prefix) or value == END_OF_MIB_VIEW:
+                    return rows
+
+                # A misbehaving agent could otherwise keep the walk (and the device lock) going forever
+                key = _oid_key(oid)
+                if key <= previous:
+                    raise SNMPError(f'OID not increasing: {oid} returned by {self.ip} after {column_oid}')
+                previous = key
+                rows[oid[len(prefix):]] = value
+
+        raise SNMPError(f'Walk of {column_oid} on {self.ip} did not finish after {MAX_WALK_REQUESTS} requests')
+
+    def get(self, oids):
+        """Blocking version of get_async"""
+        return self.transport.run(self.get_async(oids))
+
+    def set(self, varbinds):
+        """Blocking version of set_async"""
+        return self.transport.run(self.set_async(varbinds))
+
+
+def _oid_key(oid):
+    """Returns a tuple that sorts OIDs in lexicographic (MIB) order"""
+    return tuple(int(n) for n in oid.strip('.').split('.'))
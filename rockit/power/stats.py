@@ -0,0 +1,137 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Low overhead latency and error counters for device queries and daemon methods"""
+
+from bisect import bisect_left
+import socket
+import threading
+import time
+import Pyro4
+from .snmp import SNMPTimeout
+
+# Histogram bucket upper bounds in seconds: 4 buckets per doubling from 100us to ~100s
+# Recording a sample is a bisection and a few increments, so stats are always enabled
+BUCKET_BOUNDS = [1e-4 * 2 ** (i / 4) for i in range(81)]
+
+
+class Outcome:
+    """Result of an instrumented operation"""
+    Success, Error, Timeout, ParseError = range(4)
+
+
+def outcome_for(exception):
+    """Returns the Outcome that describes an exception raised by a device query"""
+    if isinstance(exception, (SNMPTimeout, Pyro4.errors.TimeoutError, socket.timeout)):
+        return Outcome.Timeout
+    return Outcome.Error
+
+
+class OperationStats:
+    """Latency histogram and outcome counters for a single operation"""
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.outcomes = [0, 0, 0, 0]
+        self.last_success = None
+
+    def record(self, duration, outcome):
+        """Records the duration (in seconds) and outcome of a single call"""
+        self.buckets[bisect_left(BUCKET_BOUNDS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.outcomes[outcome] += 1
+        if outcome == Outcome.Success:
+            self.last_success = time.time()
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the histogram bucket containing the given fraction of samples"""
+        if not self.count:
+            return None
+
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def histogram(self, stride):
+        """Returns a list of (upper bound, cumulative count) pairs using every stride'th bucket bound"""
+        ret = []
+        seen = 0
+        for i, count in enumerate(self.buckets[:-1]):
+            seen += count
+            if i % stride == 0:
+                ret.append((BUCKET_BOUNDS[i], seen))
+        return ret
+
+    def snapshot(self):
+        """Returns a dictionary summarising the recorded calls"""
+        return {
+            'count': self.count,
+            'errors': self.outcomes[Outcome.Error],
+            'timeouts': self.outcomes[Outcome.Timeout],
+            'parse_errors': self.outcomes[Outcome.ParseError],
+            'last_success': self.last_success,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max if self.count else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+        }
+
+
+class PerformanceStats:
+    """Collects OperationStats for a device or daemon, keyed by operation name
+       Statistics accumulate from when the daemon starts. Durations are in seconds
+       and last_success is a unix timestamp.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def record(self, operation, duration, outcome=Outcome.Success):
+        """Records the duration (in seconds) and outcome of an operation"""
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = OperationStats()
+            stats.record(duration, outcome)
+
+    def snapshot(self):
+        """Returns a dictionary of statistics keyed by operation name"""
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in self._operations.items()}
+
+    def histograms(self, stride=4):
+        """Returns the latency histogram of each operation, merging stride adjacent buckets
+           Returns a dictionary keyed by operation name of dictionaries containing a list of
+           (upper bound, cumulative count) pairs ('buckets'), the total count, sum, and outcome counters
+        """
+        with self._lock:
+            return {name: {
+                'buckets': stats.histogram(stride),
+                'count': stats.count,
+                'sum': stats.total,
+                'errors': stats.outcomes[Outcome.Error],
+                'timeouts': stats.outcomes[Outcome.Timeout],
+                'parse_errors': stats.outcomes[Outcome.ParseError],
+            } for name, stats in self._operations.items()}
@@ -0,0 +1,218 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pushes parameter transitions to remote Pyro callback objects"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import threading
+import uuid
+import Pyro4
+from rockit.common import log
+
+# Timeout for each callback invocation
+CALLBACK_TIMEOUT = 5
+
+# Subscribers are dropped after this many consecutive failed deliveries
+MAX_DELIVERY_FAILURES = 3
+
+# Upper limit on the number of registered subscribers
+MAX_SUBSCRIBERS = 64
+
+# Number of threads shared by all subscribers for delivering events
+MAX_DELIVERY_WORKERS = 8
+
+
+class _Subscriber:
+    """Queues events for a single callback object until a delivery worker sends them
+       The queue is bounded so that a slow or disconnected subscriber never blocks the poller
+    """
+    def __init__(self, subscription_id, uri, names, queue_size):
+        self.id = subscription_id
+        self.uri = uri
+        self.names = names
+
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._queue_size = max(queue_size, 1)
+        self._scheduled = False
+        self._closed = False
+        self._callback = None
+        self._failures = 0
+        self.coalesced = 0
+
+    def push(self, date, changes):
+        """Queues an event without blocking. If the queue is full the event is merged into the newest queued event
+           Returns True if the subscriber needs to be scheduled for delivery
+        """
+        changes = {k: v for k, v in changes.items() if k in self.names}
+        if not changes:
+            return False
+
+        with self._lock:
+            if self._closed:
+                return False
+
+            if len(self._queue) >= self._queue_size:
+                _, pending = self._queue[-1]
+                for name, change in changes.items():
+                    if name in pending:
+                        change = {'from': pending[name]['from'], 'to': change['to']}
+                    if change['from'] == change['to']:
+                        pending.pop(name, None)
+                    else:
+                        pending[name] = change
+                self._queue[-1] = (date, pending)
+                self.coalesced += 1
+            else:
+                self._queue.append((date, changes))
+
+            if self._scheduled:
+                return False
+            self._scheduled = True
+            return True
+
+    def close(self):
+        """Discards the queued events and stops delivery after the current event"""
+        with self._lock:
+            self._closed = True
+            self._queue.clear()
+            release = not self._scheduled
+
+        if release and self._callback is not None:
+            self._callback._pyroRelease()
+
+    def deliver(self):
+        """Sends the queued events. Returns False if the subscriber has stopped responding"""
+        while True:
+            with self._lock:
+                if self._closed or not self._queue:
+                    self._scheduled = False
+                    closed = self._closed
+                    break
+                date, changes = self._queue.popleft()
+
+            if not changes:
+                continue
+
+            if self._callback is None:
+                self._callback = Pyro4.Proxy(self.uri)
+                self._callback._pyroTimeout = CALLBACK_TIMEOUT
+
+            try:
+                self._callback.power_changed(
+                    datetime.datetime.utcfromtimestamp(date).strftime('%Y-%m-%dT%H:%M:%SZ'), changes)
+                self._failures = 0
+            except Exception as exception:
+                self._failures += 1
+                print(f'{datetime.datetime.utcnow()} ERROR: failed to notify {self.uri}: {exception}')
+
+                # Reconnect on the next delivery
+                self._callback._pyroRelease()
+                if self._failures >= MAX_DELIVERY_FAILURES:
+                    self.close()
+                    return False
+
+        if closed and self._callback is not None:
+            self._callback._pyroRelease()
+        return True
+
+
+class SubscriptionManager:
+    """Tracks remote subscribers and pushes the parameters that change value after each poll
+       Callback objects must expose a power_changed(date, changes) method, where changes is
+       a dictionary of {'from': old value, 'to': new value} keyed by parameter name.
+    """
+    def __init__(self, log_name, queue_size=16):
+        self._log_name = log_name
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._values = {}
+        self._date = None
+        self._executor = ThreadPoolExecutor(max_workers=MAX_DELIVERY_WORKERS)
+
+    def subscribe(self, callback, names):
+        """Registers a callback (Pyro proxy or URI) for changes to the given parameter names.
+           The current value of each parameter is queued as the first event, or sent with the
+           first poll if nothing has been polled yet.
+           Returns an id that can be passed to unsubscribe, or None if there are too many subscribers
+        """
+        uri = getattr(callback, '_pyroUri', callback)
+        subscriber = _Subscriber(str(uuid.uuid4()), uri, set(names), self._queue_size)
+        with self._lock:
+            full = len(self._subscribers) >= MAX_SUBSCRIBERS
+            if not full:
+                self._subscribers[subscriber.id] = subscriber
+                if self._date is not None:
+                    self.__push(subscriber, self._date,
+                                {k: {'from': None, 'to': v} for k, v in self._values.items()})
+
+        if full:
+            log.error(self._log_name, f'Rejected subscriber {uri}: limit of {MAX_SUBSCRIBERS} reached')
+            return None
+
+        log.info(self._log_name, f'Added subscriber {uri}')
+        return subscriber.id
+
+    def unsubscribe(self, subscription_id):
+        """Removes a subscriber. Returns False if the id is unknown"""
+        with self._lock:
+            subscriber = self._subscribers.pop(subscription_id, None)
+
+        if subscriber is None:
+            return False
+
+        subscriber.close()
+        log.info(self._log_name, f'Removed subscriber {subscriber.uri}')
+        return True
+
+    def __push(self, subscriber, date, changes):
+        if subscriber.push(date, changes):
+            self._executor.submit(self.__deliver, subscriber)
+
+    def __deliver(self, subscriber):
+        if not subscriber.deliver():
+            with self._lock:
+                self._subscribers.pop(subscriber.id, None)
+            log.error(self._log_name, f'Removed unresponsive subscriber {subscriber.uri}')
+
+    def subscribers(self):
+        """Returns a list of dictionaries describing each subscriber"""
+        with self._lock:
+            return [{
+                'id': s.id,
+                'uri': str(s.uri),
+                'parameters': sorted(s.names),
+                'coalesced': s.coalesced
+            } for s in self._subscribers.values()]
+
+    def record(self, timestamp, values):
+        """Queues the parameters that changed value for each interested subscriber
+           Parameters without a previous value (e.g. on the first poll) are reported with a 'from' of None
+        """
+        with self._lock:
+            changes = {}
+            for name, value in values.items():
+                if name not in self._values or self._values[name] != value:
+                    changes[name] = {'from': self._values.get(name), 'to': value}
+                self._values[name] = value
+            self._date = timestamp
+
+            if changes:
+                for subscriber in self._subscribers.values():
+                    self.__push(subscriber, timestamp, changes)
@@ -0,0 +1,46 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the in-memory measurement history"""
+
+from rockit.power.constants import Parameter
+from rockit.power.history import history_capacity, MeasurementHistory
+
+
+def test_capacity_covers_retention_with_fast_polling():
+    """Polling faster than once per second must still keep the full retention window"""
+    retention, poll_interval = 10, 0.5
+    capacity = history_capacity(retention, poll_interval)
+    assert isinstance(capacity, int)
+
+    history = MeasurementHistory([Parameter('a', -1)], capacity)
+    for i in range(100):
+        history.record(i * poll_interval, {'a': i})
+
+    times = history.query(['a'], 0, 1000)['time']
+    assert times[-1] - times[0] >= retention
+
+
+def test_decimated_query_across_buffer_wrap():
+    """A bin that spans the end of the ring buffer must return a single sample"""
+    history = MeasurementHistory([Parameter('a', -1)], 5)
+    for i in range(7):
+        history.record(i, {'a': i})
+
+    data = history.query(['a'], 0, 10, step=2)
+    assert data['time'] == [2, 4, 6]
+    assert data['a'] == [2, 4, 6]
@@ -0,0 +1,63 @@
+#
+# This file is part of the Robotic Observatory Control Kit (rockit)
+#
+# rockit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rockit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rockit.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the background device poller"""
+
+import threading
+import time
+from rockit.power.constants import Parameter
+from rockit.power.poller import DevicePoller
+
+
+class SlowDevice:
+    """Device whose status query takes longer than the poll interval"""
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.parameters = [Parameter(name, 0)]
+        self.parameters_by_name = {p.name: p for p in self.parameters}
+        self.poll_interval = None
+
+    def status(self):
+        time.sleep(self.delay)
+        return {self.name: 1}
+
+
+def test_notifications_on_each_tick_with_slow_device():
+    """A device slower than poll_interval must not skip, delay, or double up the tick notifications"""
+    poll_interval = 0.2
+    poller = DevicePoller([SlowDevice('fast', 0), SlowDevice('slow', 1.5 * poll_interval)], poll_interval, 1)
+
+    lock = threading.Lock()
+    calls = []
+
+    def listener(sample_time, values):
+        with lock:
+            calls.append((time.monotonic(), values))
+
+    poller.add_listener(listener)
+    poller.start()
+    time.sleep(12 * poll_interval)
+
+    with lock:
+        times = [t for t, _ in calls]
+        values = calls[-1][1]
+
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert len(times) >= 10
+    assert all(0.5 * poll_interval < gap < 1.5 * poll_interval for gap in gaps), gaps
+    assert values == {'fast': 1, 'slow': 1}